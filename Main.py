@@ -2,19 +2,41 @@
 # Creator: Maia Goldberg
 # Date created: April.6/20
 # Last modified: May.17/20
+import os
+import sys
+import copy
+import hashlib
+import heapq
 import pygame
 import random
 import math
+import operator
+import struct
+import time
+from array import array
+from collections import OrderedDict
 # will make it easier to use pygame functions
 from pygame.draw import line, circle, rect
 
-# initializes the pygame module
-pygame.init()
-# creates a screen variable of the tile width/length * the number of rows/cols
-screen = pygame.display.set_mode([552, 600])
+# PACMAN_HEADLESS=1 lets the game run as a simulation without a window or a sound card
+HEADLESS = bool(os.environ.get("PACMAN_HEADLESS"))
+if HEADLESS:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# the window is only created (and pygame initialized) once the game is first drawn
+screen = None
+# set by open_offscreen, the game is then drawn into a surface in memory instead of a window
+offscreen = False
 
 # sets the frame rate of the program
 clock = pygame.time.Clock()
+TICK_RATE = 60  # the game logic runs this many ticks a second no matter how fast frames are drawn
+# the most frames drawn a second, the same as the tick rate since frames in between only move things a little,
+# 0 draws them as fast as possible which keeps a core busy (python Main.py --uncapped)
+MAX_FPS = 60
+MAX_TICKS_PER_FRAME = 5  # ticks caught up on in one frame before the game slows down instead of skipping ahead
+MAX_WINDOW_SIZE = (1280, 960)  # mazes too big to fit in this are drawn with smaller tiles
 
 # Constant colors
 WHITE = (255, 255, 255)
@@ -32,32 +54,261 @@ DIRECTIONS = (UP, DOWN, LEFT, RIGHT)
 DIRECTIONS_STR = {UP: "up", DOWN: "down", LEFT: "left", RIGHT: "right"}
 # Used when changing states
 REVERSED_DIRECTIONS = {UP: DOWN, DOWN: UP, RIGHT: LEFT, LEFT: RIGHT, STOP: STOP}
+# bit used for each direction in the maze's table of exits out of a tile
+DIRECTION_BITS = {UP: 1, DOWN: 2, LEFT: 4, RIGHT: 8, STOP: 0}
+# the directions allowed by each combination of exit bits, in the order the ghosts try them
+EXIT_DIRECTIONS = [tuple(d for d in DIRECTIONS if mask & DIRECTION_BITS[d]) for mask in range(16)]
 
 # States
 SCATTER = 0
 CHASE = 1
 SCARED = 2
 EATEN = 3
+# the state each timed state changes to once its time is up
+NEXT_STATES = {SCATTER: CHASE, CHASE: SCATTER, SCARED: CHASE}
+
+
+def open_window(size=(552, 600)):
+    # initializes the pygame module and creates a screen of the tile width/length * the number of rows/cols
+    global screen
+    if offscreen:
+        return open_offscreen(size)
+    if screen is None:
+        pygame.init()
+        screen = pygame.display.set_mode(size)
+    elif screen.get_size() != tuple(size):
+        screen = pygame.display.set_mode(size)
+    return screen
+
+
+def open_offscreen(size=(552, 600)):
+    # makes everything that's drawn go onto a surface in memory instead of the window (see capture.py)
+    # the surface is 24 bit with the bytes of a pixel in rgb order, so its pixels are laid out the way a numpy
+    # image is and can be copied out with plain memory copies
+    # pygame still needs a display mode to convert images for, a 1 pixel one that's never shown is used if
+    # there's no window, with PACMAN_HEADLESS set it uses the dummy video driver
+    global screen, offscreen
+    if not offscreen or screen.get_size() != tuple(size):
+        if pygame.display.get_surface() is None:
+            pygame.init()
+            pygame.display.set_mode((1, 1))
+        screen = pygame.Surface(size, 0, 24, (0xFF, 0xFF00, 0xFF0000, 0))
+        offscreen = True
+    return screen
+
+
+class Assets:
+    # loads images, sounds and fonts the first time they are used and keeps them for the next time
+    # sprites can also be packed into one pre-scaled atlas file per tile size with build_atlas
+    SPRITES = ["cherry"] + [name + "_" + value for name in ("pac", "blinky", "pinky", "inky", "clyde", "scared", "eyes")
+                            for value in DIRECTIONS_STR.values()]
+
+    def __init__(self):
+        self.images = {}  # (name, size) -> scaled surface
+        self.sounds = {}
+        self.fonts = {}
+        self.atlases = {}  # size -> atlas surface, or None if there is no atlas for that size
+
+    @staticmethod
+    def atlas_file(size):
+        return "atlas_" + str(size) + ".png"
+
+    def image(self, name, size):
+        img = self.images.get((name, size))
+        if img is None:
+            atlas = self.atlas(size)
+            if atlas is not None:
+                # the sprites are laid out in a row in the order of SPRITES
+                img = atlas.subsurface((self.SPRITES.index(name) * size, 0, size, size))
+            else:
+                img = pygame.transform.scale(pygame.image.load(name + ".png").convert_alpha(), (size, size))
+            self.images[(name, size)] = img
+        return img
+
+    def atlas(self, size):
+        if size not in self.atlases:
+            self.atlases[size] = None
+            if os.path.exists(self.atlas_file(size)):
+                self.atlases[size] = pygame.image.load(self.atlas_file(size)).convert_alpha()
+        return self.atlases[size]
+
+    def build_atlas(self, size):
+        # scales every sprite once and saves them side by side in a single image
+        atlas = pygame.Surface((len(self.SPRITES) * size, size), pygame.SRCALPHA)
+        for i, name in enumerate(self.SPRITES):
+            atlas.blit(pygame.transform.scale(pygame.image.load(name + ".png"), (size, size)), (i * size, 0))
+        pygame.image.save(atlas, self.atlas_file(size))
+        self.atlases.pop(size, None)
+        self.images.clear()
+
+    def sound(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            sound = self.sounds[name] = pygame.mixer.Sound(name + ".wav")
+        return sound
+
+    def font(self, name, size):
+        font = self.fonts.get((name, size))
+        if font is None:
+            pygame.font.init()
+            font = self.fonts[(name, size)] = pygame.font.SysFont(name, size)
+        return font
+
+
+assets = Assets()
+
+
+class TextCache:
+    # text that has been rendered is kept so the HUD isn't rendered again every frame, only a new message is
+    # rendered and the least recently used ones are dropped once there are more than size of them
+    def __init__(self, size=64):
+        self.size = size
+        self.surfaces = OrderedDict()  # message -> surface, oldest first
+        self.glyphs = {}  # character -> surface, numbers that change often are put together from these
+
+    def text(self, message):
+        surface = self.surfaces.get(message)
+        if surface is None:
+            surface = self.surfaces[message] = assets.font(*Game.font).render(message, 10, WHITE)
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(message)
+        return surface
+
+    def glyph(self, character):
+        surface = self.glyphs.get(character)
+        if surface is None:
+            surface = self.glyphs[character] = assets.font(*Game.font).render(character, 10, WHITE)
+        return surface
+
+
+text_cache = TextCache()
+
+
+class SpriteSet:
+    # the images of a character facing each direction, they are loaded the first time they are drawn
+    def __init__(self, name):
+        # the name of the image file for each direction
+        self.files = {direction: name + "_" + value for direction, value in DIRECTIONS_STR.items()}
+        self.files[STOP] = self.files[RIGHT]  # if the sprite is stopped it will use the image for when it's facing right
+
+    def image(self, direction, size):
+        return assets.image(self.files[direction], size)
+
+
+class SoundManager:
+    # plays the game's sounds on a few mixer channels kept for them, so however fast sounds are asked for
+    # only that many are ever mixed at once
+    # a sound that's already playing isn't started again on top of itself, and one asked for again within its
+    # min interval of when it was last started is skipped
+    # when every channel is busy a sound takes the channel of the lowest priority sound playing, as long as
+    # that one has a lower priority than it, otherwise it's dropped
+    PRIORITIES = {"start": 3, "death": 3, "eatghost": 2, "eatfruit": 1, "chomp": 0}
+    MIN_INTERVALS = {"chomp": 0.1, "eatghost": 0.05, "eatfruit": 0.05}  # in seconds
+
+    def __init__(self, num_channels=4):
+        self.num_channels = num_channels
+        self.channels = None  # the mixer is only started the first time a sound is played
+        self.playing = []  # the name of the sound last started on each channel
+        self.last_played = {}  # sound name -> when it was last started
+        self.enabled = True  # turned off if there's no sound device to play on
+        # what happened to the sounds asked for
+        self.played = 0
+        self.coalesced = 0  # already playing
+        self.throttled = 0  # asked for again too soon
+        self.preempted = 0  # cut off by a sound with a higher priority
+        self.dropped = 0  # every channel was busy with sounds at least as important
+
+    def open(self):
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+        except pygame.error:
+            self.enabled = False
+            return
+        # the first num_channels channels are reserved so Sound.play elsewhere can't take them
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), self.num_channels))
+        pygame.mixer.set_reserved(self.num_channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(self.num_channels)]
+        self.playing = [None] * self.num_channels
+
+    def play(self, name):
+        now = time.perf_counter()
+        last = self.last_played.get(name)
+        if last is not None and now - last < self.MIN_INTERVALS.get(name, 0):
+            self.throttled += 1
+            return False
+        if self.channels is None:
+            self.open()
+        if not self.enabled:
+            return False
+        priorities = self.PRIORITIES
+        free = lowest = None
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                if free is None:
+                    free = i
+            elif self.playing[i] == name:
+                self.coalesced += 1
+                return False
+            elif lowest is None or priorities.get(self.playing[i], 0) < priorities.get(self.playing[lowest], 0):
+                lowest = i
+        if free is None:
+            if priorities.get(self.playing[lowest], 0) >= priorities.get(name, 0):
+                self.dropped += 1
+                return False
+            free = lowest
+            self.channels[free].stop()
+            self.preempted += 1
+        self.channels[free].play(assets.sound(name))
+        self.playing[free] = name
+        self.last_played[name] = now
+        self.played += 1
+        return True
+
+
+class NullSoundManager:
+    # used instead of SoundManager when PACMAN_HEADLESS is set, the mixer is never started and nothing is loaded
+    enabled = False
+
+    def play(self, name):
+        return False
+
+
+sounds = NullSoundManager() if HEADLESS else SoundManager()
+
+
+class LazySound:
+    # a sound that is only loaded the first time it is played, it's played through the sound manager
+    def __init__(self, name):
+        self.name = name
+
+    def play(self):
+        sounds.play(self.name)
 
 
 def load_img(sprite_file):
-    # loads in images and stores them in a dictionary correlating them to their direction
-    sprites = {}
-    for direction, value in DIRECTIONS_STR.items():  # value = the string of the direction
-        img = pygame.image.load(sprite_file + "_" + value + ".png").convert_alpha()
-        sprites[direction] = pygame.transform.scale(img, (Game.tile_size, Game.tile_size))
-    sprites[STOP] = sprites[RIGHT]  # if the sprite is stopped it will use the image for when it's facing right
-    return sprites
+    # gives the images for each direction, correlating them to their direction
+    return SpriteSet(sprite_file)
 
 
 def load_sound(sound_file):  # imports sound files
-    sound = pygame.mixer.Sound(sound_file + ".wav")
-    return sound
+    return LazySound(sound_file)
 
 
 def display_text(message, position):  # renders text and prints it on the screen
-    text_display = Game.font.render(message, 10, WHITE)
-    screen.blit(text_display, position)
+    return screen.blit(text_cache.text(message), position)  # returns the area of the screen that was drawn on
+
+
+def display_number(label, number, position):
+    # prints the label and then the number one digit at a time, so a new number never has to be rendered
+    drawn = screen.blit(text_cache.text(label), position)
+    for digit in str(number):
+        drawn = drawn.union(screen.blit(text_cache.glyph(digit), (drawn.right, position[1])))
+    return drawn
 
 
 class PacDot:
@@ -76,53 +327,82 @@ class Cherry:
         self.generate_random_pos()
         self.points = 200
 
-        # loads the image for cherry
-        self.cherryLoad = pygame.image.load("cherry.png").convert_alpha()
-        self.cherry_sprite = pygame.transform.scale(self.cherryLoad, (self.game.tile_size, self.game.tile_size))
-
     def draw(self):  # blits the sprite to the screen
-        screen.blit(self.cherry_sprite, (self.x * self.game.tile_size, self.y * self.game.tile_size))
+        cherry_sprite = assets.image("cherry", self.game.tile_size)
+        return screen.blit(cherry_sprite, (self.x * self.game.tile_size, self.y * self.game.tile_size))
 
     def generate_random_pos(self):
         # generates a random x/y co-ordinate
-        self.x = random.randint(0, 22)
-        self.y = random.randint(0, 24)
+        self.x = random.randint(0, self.game.maze.width - 1)
+        self.y = random.randint(0, self.game.maze.height - 1)
 
 
 class Game:
     # dictionary to hold information correlating character on map to type of edible
     edibles = {"*": PacDot, "@": Energizer}
-    tile_size = 24
+    tile_size = 24  # the size tiles are drawn at, unless the maze is too big to fit in the window at this size
     start_noise = load_sound("start")
-    font = pygame.font.SysFont('rockwell', 18)  # font used for on-screen text
+    font = ("rockwell", 18)  # font used for on-screen text
 
-    def __init__(self):
+    def __init__(self, headless=HEADLESS, maze_aware_ghosts=False, death_pause_ticks=None, maze_file=None,
+                 num_ghosts=4):
         self.done = False
+        # a headless game only runs the game logic, nothing is drawn, played or waited on
+        self.headless = headless
+        # ticks the game stops for after pacman dies, 2 seconds unless headless where there's no pause
+        if death_pause_ticks is None:
+            death_pause_ticks = 0 if headless else 2 * TICK_RATE
+        self.death_pause_ticks = death_pause_ticks
+        self.death_pause_left = 0
+        self.death_pos = None  # where pacman was caught
+        self.recorder = None  # when set, it's given the input of every tick (see replay.py)
+        self.telemetry = None  # when set, it's given the game after every tick (see telemetry.py)
+        self.autopilot = None  # when set, it steers pacman instead of the keyboard (see autopilot.py)
+        # ghosts measure distances along the maze's paths instead of in a straight line (see Maze.path_distance)
+        self.maze_aware_ghosts = maze_aware_ghosts
         self.score = 0
+        self.high_score = 0  # the best score saved so far, shown on the start screen (see results.py)
         self.ticks = 0  # will be used to slow movement by only moving character after a certain amount of ticks
         self.level = 1
         # number of seconds in timed state multiplied by frames per second
         self.time_in_state = {SCATTER: 7 * 60, CHASE: 20 * 60, SCARED: 10 * 60}
+        # when the characters' timed states run out, and the ghosts that are heading home to the ghost house,
+        # the characters only check their state on ticks where one of these could change it
+        self.state_schedule = StateSchedule()
+        self.eaten = set()
+        self.watch_states = False
+
+        self.maze = Maze(maze_file)  # instantiation of the map, the built in one unless a maze file is given
+        self.maze.load_map()
+        self.tile_size = max(1, min(Game.tile_size, MAX_WINDOW_SIZE[0] // self.maze.width,
+                                    MAX_WINDOW_SIZE[1] // self.maze.height))
+        self.window_size = (self.maze.width * self.tile_size, self.maze.height * self.tile_size)
 
         # instantiation of the character and passes them game
+        # more than four ghosts (for swarms on big mazes) take turns being each kind, starting where that kind does
         self.pac = Pacman(self)
-        self.blinky = Blinky(self)
-        self.pinky = Pinky(self)
-        self.inky = Inky(self)
-        self.clyde = Clyde(self)
+        ghosts = [(Blinky, Pinky, Inky, Clyde)[i % 4](self) for i in range(num_ghosts)]
+        self.blinky, self.pinky, self.inky, self.clyde = (ghosts + [None] * 4)[:4]
 
-        self.charList = [self.blinky, self.pinky, self.inky, self.clyde, self.pac]
+        self.charList = ghosts + [self.pac]
         # pac goes at the end of the list so all ghosts move before him
+        for number, character in enumerate(self.charList):
+            character.number = number
+        self.build_occupants()
+        self.schedule_states()
 
         self.cherry = Cherry(self)  # instantiation of the cherry
         self.caught_cherry = False  # will be used to ensure the cherry is only touched once
         self.display_start_screen = True
         self.play_start_noise = True
+        self.interpolation = 0  # how far between the last tick and the next one the frame is being drawn
 
-        self.maze = Maze()  # instantiation of the map
-        self.maze.load_map()
+        # cached drawings of the maze, built the first time the game is drawn
+        self.walls_layer = None
+        self.maze_layer = None
+        self.dirty_rects = []  # areas of the screen that need to be redrawn from the maze layer
 
-    def draw_game(self):
+    def draw_walls(self, surface):
         ts = self.tile_size
 
         # counter variables which will increase as it moves across the rows/columns
@@ -131,62 +411,232 @@ class Game:
             x = 0
             for c in r:
                 if c == "#":  # if there is a wall draw a rectangle
-                    rect(screen, BLUE, (x * ts, y * ts, ts, ts), 0)
-                else:
-                    edible = self.edibles.get(c)  # checks if c(the symbol on the map) is in the edibles dictionary
-                    if edible is not None:  # as long as it is(not none) will draw a circle
-                        circle(screen, WHITE,
-                               ((x * ts) + ts // 2,
-                                (y * ts) + ts // 2,), edible.RADIUS, 0)
+                    rect(surface, BLUE, (x * ts, y * ts, ts, ts), 0)
                 x += 1
             y += 1
 
+    def draw_dots(self, surface):
+        ts = self.tile_size
+
+        y = 0
+        for r in self.maze.tiles:
+            x = 0
+            for c in r:
+                edible = self.edibles.get(c)  # checks if c(the symbol on the map) is in the edibles dictionary
+                if edible is not None:  # as long as it is(not none) will draw a circle
+                    circle(surface, WHITE,
+                           ((x * ts) + ts // 2,
+                            (y * ts) + ts // 2,), edible.RADIUS, 0)
+                x += 1
+            y += 1
+
+    def build_maze_layers(self):
+        # the walls never change within a level so they are drawn once onto their own surface
+        self.walls_layer = pygame.Surface(screen.get_size()).convert()
+        self.walls_layer.fill(BLACK)
+        self.draw_walls(self.walls_layer)
+        # the dots go on a copy of the walls which has dots erased from it as they are eaten
+        self.maze_layer = self.walls_layer.copy()
+        self.draw_dots(self.maze_layer)
+
+    def clear_tile(self, x, y):
+        # erases an eaten dot from the maze layer, nothing needs to be done until the maze has been drawn
+        if self.maze_layer is not None:
+            ts = self.tile_size
+            tile_rect = pygame.Rect(x * ts, y * ts, ts, ts)
+            self.maze_layer.blit(self.walls_layer, tile_rect, tile_rect)
+            self.dirty_rects.append(tile_rect)
+
+    def draw_game(self):
+        # restores the parts of the screen that were drawn over last frame and returns them
+        if self.maze_layer is None:
+            # the first frame of a level draws the whole maze
+            self.build_maze_layers()
+            screen.blit(self.maze_layer, (0, 0))
+            return [screen.get_rect()]
+        for area in self.dirty_rects:
+            screen.blit(self.maze_layer, area, area)
+        return self.dirty_rects
+
+    def draw(self):
+        # draws the frame and returns the areas of the screen that changed since the last one
+        open_window(self.window_size)
+        restored = self.draw_game()
+        drawn = self.game_text()
+
         # the cherry is only displayed if the score is higher than seven hundred
         # self.caught_cherry is used to ensure pacman can only touch the cherry once
+        if self.cherry_visible():
+            drawn.append(self.cherry.draw())
+
+        # draws the characters
+        if self.display_start_screen:
+            drawn.append(self.start_screen())
+        elif self.death_pause_left > 0:
+            drawn.append(self.pac.draw_death())
+        else:
+            for character in self.charList:
+                drawn.append(character.draw())
+
+        # whatever was drawn this frame has to be cleaned up at the start of the next one
+        self.dirty_rects = drawn
+        return restored + drawn
+
+    def cherry_visible(self):
+        # the cherry is drawn once it has been placed on an empty space and hasn't been caught
+        return self.score > 700 and not self.caught_cherry and self.maze.tiles[self.cherry.y][self.cherry.x] == "_"
+
+    def update_cherry(self):
+        # the cherry only shows up once the score is higher than seven hundred
         if self.score > 700 and not self.caught_cherry:
             if self.maze.tiles[self.cherry.y][self.cherry.x] != "_":
                 # checks that if the space isn't empty a new position is generated
                 self.cherry.generate_random_pos()
-            else:
-                self.cherry.draw()
+
+    def update(self):
+        # runs the game logic for the current tick without drawing anything
+        self.update_cherry()
+
+        # moves the characters
+        if self.display_start_screen:
+            self.update_start_screen()
+        else:
+            # a ghost eaten during the tick (see Character.set_state) turns this on for the characters after it
+            self.watch_states = self.state_schedule.due(self.ticks) or len(self.eaten) > 0
+            for character in self.charList:
+                if self.watch_states:
+                    character.choose_state()
+                if (self.ticks % character.move_rate) == 0:
+                    # used to slow down movement by only moving a character every 8(move_rate) ticks
+                    character.move()
+                self.pac.check_intersect()
+
+        if self.pac.lives < 1:
+            # the game has ended, that way when loop restarts a new game will be created
+            self.done = True
+            return
+
+        if self.maze.num_edibles == 0:  # if there are no more dots to be eaten on the screen
+            self.level_up()
+
+    def step(self, action=None):
+        # advances the game by one tick, action is the direction pacman is steered in (None keeps his direction)
+        # used to run the game as a simulation, so no drawing, sound or frame limiting happens here
+        self.pac.next_direction = action
+        self.advance()
+        return self.done
+
+    def advance(self):
+        # runs one tick, unless the game is paused after pacman died
+        # the pause doesn't count as game time so none of the timers move during it
+        if self.death_pause_left > 0:
+            self.death_pause_left -= 1
+            return
+        if self.recorder is not None:
+            self.recorder.record(self)
+        self.update()
+        self.ticks += 1
+        if self.telemetry is not None:
+            self.telemetry.record(self)
+
+    def pause_for_death(self, position):
+        self.death_pos = position
+        self.death_pause_left = self.death_pause_ticks
 
     def play(self):
+        open_window(self.window_size)
         self.done = False
+        tick_time = 1 / TICK_RATE
+        lag = 0  # time that has passed that the game logic hasn't caught up on
+        last_time = time.perf_counter()
         while not self.done:
-            # makes the background the colour WHITE
-            screen.fill(BLACK)
-            self.pac.set_key()  # pre store user actions
-            self.draw_game()
-            self.game_text()
-
-            # moves/draws the characters
-            if self.display_start_screen:
-                self.start_screen()
-            else:
-                for character in self.charList:
-                    character.choose_state()
-                    if (self.ticks % character.move_rate) == 0:
-                        # used to slow down movement by only moving a character every 8(move_rate) ticks
-                        character.move()
-                    self.pac.check_intersect()
-                    character.draw()
-
-            if self.pac.lives < 1:
-                # exits the loop since game has ended, that way when loop restarts a new game will be created
-                return
+            now = time.perf_counter()
+            lag = min(lag + now - last_time, MAX_TICKS_PER_FRAME * tick_time)
+            last_time = now
+
+            # runs as many ticks as fit in the time since the last frame
+            while lag >= tick_time:
+                if self.autopilot is None:
+                    self.pac.set_key()  # pre store user actions
+                else:
+                    self.pac.next_direction = self.autopilot(self)
+                self.advance()
+                if self.done:
+                    # exits the loop since game has ended
+                    return
+                lag -= tick_time
 
-            if self.maze.num_edibles == 0:  # if there are no more dots to be eaten on the screen
-                self.level_up()
+            # the frame is drawn part of the way to the next tick so movement stays smooth
+            self.interpolation = lag / tick_time
+            changed = self.draw()
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:  # when the ex button is pressed
                     self.end()
-
-                # this line draws everything into the window all at once
-            pygame.display.flip()
-            # this line limits the frames per second to 60
-            clock.tick(60)
-            self.ticks += 1
+                    return
+
+            # this line only sends the parts of the window that changed to the display
+            pygame.display.update(changed)
+            # this line limits the frames per second
+            clock.tick(MAX_FPS)
+
+    def snapshot(self):
+        # saves everything about the game that changes as it's played
+        return GameState(self)
+
+    def restore(self, state):
+        # puts the game back to how it was when the snapshot was taken
+        self.ticks = state.ticks
+        self.score = state.score
+        self.level = state.level
+        self.done = state.done
+        self.caught_cherry = state.caught_cherry
+        self.cherry.x, self.cherry.y = state.cherry_pos
+        self.display_start_screen = state.display_start_screen
+        self.play_start_noise = state.play_start_noise
+        self.time_in_state[SCATTER] = state.scatter_time
+        self.pac.lives = state.lives
+        self.pac.num_ghosts_eaten = state.num_ghosts_eaten
+        self.pac.total_ghosts_eaten = state.total_ghosts_eaten
+        if self.maze.pellets != state.pellets:
+            self.maze.set_pellets(state.pellets)
+            self.maze_layer = None  # the dots have to be redrawn
+        self.maze.num_edibles = state.num_edibles
+        self.death_pause_left = state.death_pause_left
+        self.death_pos = state.death_pos
+        values = state.characters
+        i = 0
+        for character in self.charList:
+            character.x, character.y, character.direction, character.state, character.change_state_time = \
+                values[i:i + 5]
+            i += 5
+        self.build_occupants()
+        self.schedule_states()
+
+    def clone(self):
+        # makes a separate copy of the game to play on, the sprites and sounds are shared
+        game = object.__new__(Game)
+        game.__dict__.update(self.__dict__)
+        game.time_in_state = dict(self.time_in_state)
+        game.maze = self.maze.copy()
+        game.maze_layer = None
+        game.dirty_rects = []
+        game.charList = [character.copy(game) for character in self.charList]
+        game.blinky, game.pinky, game.inky, game.clyde = (game.charList[:-1] + [None] * 4)[:4]
+        game.pac = game.charList[-1]
+        game.build_occupants()
+        game.schedule_states()
+        game.cherry = copy.copy(self.cherry)
+        game.cherry.game = game
+        game.recorder = None
+        game.telemetry = None
+        game.autopilot = None
+        return game
+
+    def play_sound(self, sound):
+        # sounds are skipped when the game is running headless
+        if not self.headless:
+            sound.play()
 
     def end(self):
         # exits the program
@@ -198,32 +648,69 @@ class Game:
         # resets the characters to their original positions without resetting the whole game(score, lives, etc.)
         for character in self.charList:
             character.set_start_pos()
+        self.build_occupants()
+
+    def schedule_states(self):
+        # works out the schedule again from the characters, used when their states have been set directly
+        self.state_schedule = StateSchedule()
+        self.eaten = set()
+        for character in self.charList:
+            if character.state in self.time_in_state:
+                self.state_schedule.add([character], character.change_state_time)
+            elif character.state == EATEN:
+                self.eaten.add(character)
+
+    def scare_ghosts(self):
+        # an energizer scares every character at once (pacman too, like set_state(SCARED) on each of them would)
+        # so all of their scared time runs out on the same tick
+        change_state_time = self.ticks + self.time_in_state[SCARED]
+        for character in self.charList:
+            character.state = SCARED
+            character.change_state_time = change_state_time
+        self.state_schedule.add(self.charList, change_state_time)
+        self.eaten.clear()
+        self.pac.num_ghosts_eaten = 0
+
+    def build_occupants(self):
+        # which characters are on each tile, Character.move keeps it up to date so finding the ghosts pacman
+        # has run into never means looking at every ghost
+        self.occupants = {}
+        for character in self.charList:
+            self.occupants.setdefault((character.x, character.y), []).append(character)
 
     def game_text(self):
         # draws text that will constantly displayed on the screen
-        display_text("score: " + str(self.score), (1, 1))
-        display_text("lives: " + str(self.pac.lives), (390, 1))
-        display_text("level: " + str(self.level), (250, 1))
+        return [display_number("score: ", self.score, (1, 1)),
+                display_text("lives: " + str(self.pac.lives), (390, 1)),
+                display_text("level: " + str(self.level), (250, 1))]
 
     def start_screen(self):
-        # will display start text and play start noises
-        display_text("READY!", (10.25 * self.tile_size, 11 * self.tile_size))
+        # will display start text
+        x, y = self.maze.markers["house"]
+        drawn = display_text("READY!", ((x - 0.75) * self.tile_size, y * self.tile_size))
+        if self.high_score:
+            drawn = drawn.union(display_number("high score: ", self.high_score,
+                                               ((x - 2.5) * self.tile_size, (y + 1) * self.tile_size)))
+        return drawn
+
+    def update_start_screen(self):
+        # plays the start noise and keeps the start screen up for 4 seconds
         if self.play_start_noise:  # ensures that the noise is only played once
-            self.start_noise.play()
+            self.play_sound(self.start_noise)
             self.play_start_noise = False
-        if self.ticks > 4 * 60:  # keeps the text being displayed for 4 seconds
+        if self.ticks > 4 * 60:
             self.display_start_screen = False
 
     def level_up(self):
         #  reloads the map and resets the characters to there original positions
         self.level += 1
         self.reset_pos()
-        self.maze.tiles.clear()
-        self.maze.load_map()
-        self.maze.num_edibles = 212
+        self.maze.load_map()  # puts all the edibles back
+        self.maze_layer = None  # the maze is redrawn for the new level
         self.caught_cherry = False
         for character in self.charList:
-            character.state = SCATTER
+            character.state = SCATTER  # their scatter time carries on from whatever state they were in
+        self.schedule_states()
 
         # changes the amount of time spent in scatter depending on the level
         if 2 <= self.level <= 5:
@@ -232,6 +719,279 @@ class Game:
             self.time_in_state[SCATTER] = 1
 
 
+class StateSchedule:
+    # the ticks when characters' timed states run out, kept in a heap with the characters due on each one
+    # entries aren't removed when a character's state changes early, they're skipped once their tick comes
+    def __init__(self):
+        self.ticks = []
+        self.characters = {}  # tick -> characters whose state may run out then
+
+    def add(self, characters, tick):
+        due = self.characters.get(tick)
+        if due is None:
+            self.characters[tick] = list(characters)
+            heapq.heappush(self.ticks, tick)
+        else:
+            due.extend(characters)
+
+    def due(self, now):
+        # whether any character's timed state runs out at or before now, a single comparison on most ticks
+        while self.ticks and self.ticks[0] <= now:
+            tick = self.ticks[0]
+            due = [character for character in self.characters[tick] if character.change_state_time == tick and
+                   character.state in character.game.time_in_state]
+            if due:
+                self.characters[tick] = due
+                return True
+            heapq.heappop(self.ticks)
+            del self.characters[tick]
+        return False
+
+
+class GameState:
+    # a small copy of everything that changes while a game is played, used to go back to an earlier point
+    # the random module's state is not part of it
+    __slots__ = ("ticks", "score", "level", "lives", "num_ghosts_eaten", "total_ghosts_eaten", "done", "caught_cherry", "cherry_pos",
+                 "display_start_screen", "play_start_noise", "scatter_time", "pellets", "num_edibles", "characters",
+                 "death_pause_left", "death_pos")
+
+    def __init__(self, game):
+        self.ticks = game.ticks
+        self.score = game.score
+        self.level = game.level
+        self.done = game.done
+        self.caught_cherry = game.caught_cherry
+        self.cherry_pos = (game.cherry.x, game.cherry.y)
+        self.display_start_screen = game.display_start_screen
+        self.play_start_noise = game.play_start_noise
+        self.scatter_time = game.time_in_state[SCATTER]
+        self.lives = game.pac.lives
+        self.num_ghosts_eaten = game.pac.num_ghosts_eaten
+        self.total_ghosts_eaten = game.pac.total_ghosts_eaten
+        self.pellets = game.maze.pellets  # one bit per tile with an edible on it
+        self.num_edibles = game.maze.num_edibles
+        self.death_pause_left = game.death_pause_left
+        self.death_pos = game.death_pos
+        # position, direction, state and state timer of each character packed one after the other in charList order
+        values = []
+        for character in game.charList:
+            values += (character.x, character.y, character.direction, character.state, character.change_state_time)
+        self.characters = tuple(values)
+
+
+class CompiledMaze:
+    # everything about a maze layout that never changes while it's played, worked out once per layout
+    # it's saved in CACHE_DIR so later runs only read it back, and games with the same layout share one in memory
+    # tiles are numbered row by row (y * width + x), the walkable tiles are also numbered in the same order as cells
+    MAGIC = b"PACMAZE"
+    VERSION = 2
+    # magic, version, width, height, number of edibles, walkable cells, ghost house tiles, tunnels,
+    # landmarks (0 when there's a table of every pair) and the type code of the distance or landmark table
+    HEADER = struct.Struct("<7sBHHIIIIHc")
+    MARKER = struct.Struct("<hh")
+    TUNNEL = struct.Struct("<IBI")  # tile, direction bit and the tile on the other side of the map it leads to
+    # with more walkable cells than this a table of every pair would be too big, instead the path lengths from
+    # NUM_LANDMARKS landmark cells to every cell are kept and distances are estimated from them
+    MAX_TABLE_CELLS = 2048
+    NUM_LANDMARKS = 16
+    CACHE_DIR = "cache"
+    loaded = {}  # key -> CompiledMaze
+
+    def __init__(self, rows, markers):
+        self.rows = rows
+        self.markers = markers
+        self.width = len(rows[0])
+        self.height = len(rows)
+        size = self.width * self.height
+        self.walkable = bytearray(r[x] != "#" for r in rows for x in range(self.width))
+        self.cells = array("i", [tile for tile in range(size) if self.walkable[tile]])
+        self.cell_index = array("i", [-1] * size)  # tile -> cell, -1 for walls
+        for cell, tile in enumerate(self.cells):
+            self.cell_index[tile] = cell
+        self.house_cells = []  # the ghost house tiles, the ones the map has a G on
+        self.pellets = 0
+        for tile in range(size):
+            if rows[tile // self.width][tile % self.width] in Game.edibles:
+                self.pellets |= 1 << tile
+        self.num_edibles = bin(self.pellets).count("1")
+        self.exits = bytearray(size)  # bits from DIRECTION_BITS for every open direction
+        self.tunnels = []  # (tile, direction bit, tile) for the moves that wrap around the edge of the map
+        self.neighbours = None
+        self.layout_hash = None
+        self.distances = None  # path lengths between every pair of cells, cell_count * start + end
+        self.num_landmarks = 0
+        self.landmark_lengths = None  # path lengths from each landmark to every cell, num_landmarks * cell + landmark
+
+    @classmethod
+    def load(cls, rows, markers):
+        # the layout's hash doesn't change with VERSION, so recordings can check they're played on the same maze
+        layout_hash = hashlib.sha1(repr((rows, sorted(markers.items()))).encode()).digest()
+        key = "%d_%s" % (cls.VERSION, layout_hash.hex())
+        maze = cls.loaded.get(key)
+        if maze is not None:
+            return maze
+        path = os.path.join(cls.CACHE_DIR, "maze_" + key + ".bin")
+        try:
+            with open(path, "rb") as f:
+                maze = cls.from_bytes(f.read())
+        except (OSError, ValueError):
+            maze = cls.compile(rows, markers)
+            try:
+                # written to a temporary file first so another process never reads half of it
+                os.makedirs(cls.CACHE_DIR, exist_ok=True)
+                temporary = path + "." + str(os.getpid())
+                with open(temporary, "wb") as f:
+                    f.write(maze.to_bytes())
+                os.replace(temporary, path)
+            except OSError:
+                pass  # the maze can still be played, it just gets compiled again next time
+        maze.layout_hash = layout_hash
+        cls.loaded[key] = maze
+        return maze
+
+    @classmethod
+    def compile(cls, rows, markers):
+        maze = cls(rows, markers)
+        maze.house_cells = [tile for tile in range(maze.width * maze.height)
+                            if rows[tile // maze.width][tile % maze.width] == "G"]
+        for tile in maze.cells:
+            y, x = divmod(tile, maze.width)
+            for direction in DIRECTIONS:
+                # the edges wrap around so the tunnel leads to the other side of the screen
+                new_x = (x + direction[0]) % maze.width
+                new_y = (y + direction[1]) % maze.height
+                if maze.walkable[new_y * maze.width + new_x]:
+                    maze.exits[tile] |= DIRECTION_BITS[direction]
+                    if (new_x, new_y) != (x + direction[0], y + direction[1]):
+                        maze.tunnels.append((tile, DIRECTION_BITS[direction], new_y * maze.width + new_x))
+        maze.build_grid()
+        if len(maze.cells) <= cls.MAX_TABLE_CELLS:
+            lengths = []
+            for cell in range(len(maze.cells)):
+                lengths += maze.lengths_from(cell)
+            # one byte per pair of cells unless the maze is big enough to have paths of 255 moves or more
+            if max(lengths, default=0) < 255:
+                maze.distances = array("B", [255 if length == -1 else length for length in lengths])
+            else:
+                maze.distances = array("H", [65535 if length == -1 else length for length in lengths])
+        else:
+            maze.build_landmarks()
+        return maze
+
+    def build_landmarks(self):
+        # the first landmarks are the tiles eaten ghosts and ghosts leaving the house head for, so those distances
+        # are exact, each one after that is the cell furthest from all the landmarks picked so far
+        starts = [self.cell_index[self.markers[name][1] * self.width + self.markers[name][0]]
+                  for name in ("house_exit", "house")]
+        rows = []
+        # path length to the closest landmark, cells no landmark can reach yet come first
+        nearest = [2 ** 32] * len(self.cells)
+        while len(rows) < min(self.NUM_LANDMARKS, len(self.cells)):
+            if starts:
+                landmark = starts.pop(0)
+            else:
+                landmark = max(range(len(self.cells)), key=nearest.__getitem__)
+            lengths = self.lengths_from(landmark)
+            rows.append(lengths)
+            nearest = [old if new == -1 or old < new else new for old, new in zip(nearest, lengths)]
+        lengths = [length for cell_lengths in zip(*rows) for length in cell_lengths]
+        self.num_landmarks = len(rows)
+        if max(lengths, default=0) < 65535:
+            self.landmark_lengths = array("H", [65535 if length == -1 else length for length in lengths])
+        else:
+            self.landmark_lengths = array("I", [2 ** 32 - 1 if length == -1 else length for length in lengths])
+
+    def to_bytes(self):
+        table = self.distances if self.distances is not None else self.landmark_lengths
+        data = [self.HEADER.pack(self.MAGIC, self.VERSION, self.width, self.height, self.num_edibles,
+                                 len(self.cells), len(self.house_cells), len(self.tunnels), self.num_landmarks,
+                                 table.typecode.encode())]
+        for name in Maze.MARKERS:
+            data.append(self.MARKER.pack(*self.markers[name]))
+        data.append("".join(self.rows).encode())
+        data.append(bytes(self.exits))
+        data.append(array("I", self.house_cells).tobytes())
+        for tunnel in self.tunnels:
+            data.append(self.TUNNEL.pack(*tunnel))
+        data.append(table.tobytes())
+        return b"".join(data)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, width, height, num_edibles, num_cells, num_house_cells, num_tunnels, num_landmarks, \
+            typecode = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a compiled maze")
+        offset = cls.HEADER.size
+        markers = {}
+        for name in Maze.MARKERS:
+            markers[name] = cls.MARKER.unpack_from(data, offset)
+            offset += cls.MARKER.size
+        grid = data[offset:offset + width * height].decode()
+        offset += width * height
+        maze = cls([grid[y * width:(y + 1) * width] for y in range(height)], markers)
+        maze.exits = bytearray(data[offset:offset + width * height])
+        offset += width * height
+        maze.house_cells = list(array("I", data[offset:offset + 4 * num_house_cells]))
+        offset += 4 * num_house_cells
+        for i in range(num_tunnels):
+            maze.tunnels.append(cls.TUNNEL.unpack_from(data, offset))
+            offset += cls.TUNNEL.size
+        table = array(typecode.decode())
+        table.frombytes(data[offset:])
+        if len(table) != num_cells * (num_landmarks or num_cells):
+            raise ValueError("the compiled maze is cut short")
+        if num_landmarks:
+            maze.num_landmarks = num_landmarks
+            maze.landmark_lengths = table
+        else:
+            maze.distances = table
+        maze.build_grid()
+        return maze
+
+    def build_grid(self):
+        # where you can go from each tile, worked out from the exits and tunnels
+        tunnels = {(tile, bit): destination for tile, bit, destination in self.tunnels}
+        self.neighbours = [{} for i in range(self.width * self.height)]  # direction -> tile it leads to
+        self.cell_neighbours = [()] * len(self.cells)  # the cells each cell leads to
+        for cell, tile in enumerate(self.cells):
+            y, x = divmod(tile, self.width)
+            for direction in EXIT_DIRECTIONS[self.exits[tile]]:
+                destination = tunnels.get((tile, DIRECTION_BITS[direction]),
+                                          (y + direction[1]) * self.width + x + direction[0])
+                self.neighbours[tile][direction] = (destination % self.width, destination // self.width)
+                self.cell_neighbours[cell] += (self.cell_index[destination],)
+
+    def lengths_from(self, start):
+        # a breadth first search from one cell following the same exits the characters use,
+        # -1 for the cells that can't be reached
+        lengths = [-1] * len(self.cells)
+        lengths[start] = 0
+        frontier = [start]
+        steps = 0
+        while frontier:
+            steps += 1
+            next_frontier = []
+            for cell in frontier:
+                for next_cell in self.cell_neighbours[cell]:
+                    if lengths[next_cell] == -1:
+                        lengths[next_cell] = steps
+                        next_frontier.append(next_cell)
+            frontier = next_frontier
+        return lengths
+
+    def path_distance(self, x1, y1, x2, y2):
+        start = self.cell_index[y1 * self.width + x1]
+        end = self.cell_index[y2 * self.width + x2]
+        if self.distances is not None:
+            return self.distances[start * len(self.cells) + end]
+        # a path can't be shorter than the difference between how far its two ends are from a landmark,
+        # the biggest difference over all the landmarks is the estimate (exact when the end is a landmark)
+        k = self.num_landmarks
+        lengths = self.landmark_lengths
+        return max(map(abs, map(operator.sub, lengths[start * k:start * k + k], lengths[end * k:end * k + k])))
+
+
 class Maze:
     MAP = """\
 #######################
@@ -260,25 +1020,112 @@ _____*__#GGGGG#__*______
 #*********************#
 #######################"""
 
-    def __init__(self):
-        self.width = 23
-        self.height = 25
+    # where the characters start and the tiles the ghosts head for on the built in map,
+    # a maze file lists these under its map (see Maze.parse)
+    MARKERS = {"pacman": (11, 18), "blinky": (11, 10), "pinky": (11, 11), "inky": (10, 11), "clyde": (12, 11),
+               "house_exit": (11, 4), "house": (11, 11),
+               "blinky_corner": (24, 1), "pinky_corner": (1, 1), "inky_corner": (24, 22), "clyde_corner": (1, 22)}
+    # characters that have to start on a tile that isn't a wall
+    SPAWNS = ("pacman", "blinky", "pinky", "inky", "clyde")
+
+    def __init__(self, path=None):
+        self.path = path  # the maze file that is played, the built in MAP if it's None
+        self.compiled = None  # everything about the layout that doesn't change, shared by every maze like it
         self.tiles = []
-        self.num_edibles = 212
+
+    @classmethod
+    def parse(cls, text, name="maze"):
+        # a maze file is a map drawn the same way as MAP, then a blank line and a "name x y" line for each marker
+        # the scatter corners can be left out, they are put just off the corners of the map like on the built in one
+        # rows longer than the first are cut off and shorter ones are filled in with walls
+        grid, _, marker_lines = text.strip("\n").partition("\n\n")
+        rows = grid.split("\n")
+        width, height = len(rows[0]), len(rows)
+        rows = [r[:width].ljust(width, "#") for r in rows]
+        markers = {"blinky_corner": (width + 1, 1), "pinky_corner": (1, 1),
+                   "inky_corner": (width + 1, height - 3), "clyde_corner": (1, height - 3)}
+        for marker in marker_lines.split("\n"):
+            if not marker.strip():
+                continue
+            parts = marker.split()
+            if len(parts) != 3 or parts[0] not in cls.MARKERS:
+                raise ValueError("%s: can't read marker %r" % (name, marker))
+            markers[parts[0]] = (int(parts[1]), int(parts[2]))
+        for marker in cls.MARKERS:
+            if marker not in markers:
+                raise ValueError("%s: the %s marker is missing" % (name, marker))
+        for marker in cls.SPAWNS + ("house_exit", "house"):
+            x, y = markers[marker]
+            if not (0 <= x < width and 0 <= y < height) or rows[y][x] == "#":
+                raise ValueError("%s: %s is not on an open tile" % (name, marker))
+        return rows, markers
 
     def load_map(self):
-        # will break the string into a new list at every line break
-        # will then break each character the row list into it's own item in the list
-        # and adds the broken string to list tiles
-        for r in self.MAP.split("\n"):
-            self.tiles.append(list(r))
+        # sets the maze up as it is at the start of a level, the layout is only read and compiled the first time
+        if self.compiled is None:
+            if self.path is None:
+                rows, markers = self.MAP.split("\n"), self.MARKERS
+                rows = [r[:len(rows[0])] for r in rows]
+            else:
+                with open(self.path) as f:
+                    rows, markers = self.parse(f.read(), self.path)
+            compiled = self.compiled = CompiledMaze.load(rows, markers)
+            self.width = compiled.width
+            self.height = compiled.height
+            self.layout = compiled.rows  # kept to put edibles back when a game is restored
+            self.markers = compiled.markers
+            self.layout_hash = compiled.layout_hash
+            self.walkable = compiled.walkable
+            self.exits = compiled.exits
+            self.neighbours = compiled.neighbours
+            # the ghost house is its G tiles and the house marker's tile, eaten ghosts are home once they reach
+            # either, so a maze whose house marker isn't on a G still gets them back
+            house_x, house_y = compiled.markers["house"]
+            self.house_cells = frozenset(compiled.house_cells) | {house_y * self.width + house_x}
+        # will break each row of the map into it's own list of characters
+        self.tiles = [list(r) for r in self.layout]
+        # one bit for every tile (numbered the same as the grid) that still has an edible on it
+        self.pellets = self.compiled.pellets
+        self.num_edibles = self.compiled.num_edibles
+
+    def remove_edible(self, x, y):
+        self.tiles[y][x] = "_"
+        self.pellets &= ~(1 << (y * self.width + x))
+        self.num_edibles -= 1
+
+    def set_pellets(self, pellets):
+        # puts back or removes edibles so the maze matches the given bits, only the tiles that differ are touched
+        changed = self.pellets ^ pellets
+        while changed:
+            bit = changed & -changed
+            y, x = divmod(bit.bit_length() - 1, self.width)
+            self.tiles[y][x] = self.layout[y][x] if pellets & bit else "_"
+            changed ^= bit
+        self.pellets = pellets
+
+    def path_distance(self, x1, y1, x2, y2):
+        # number of moves it takes to get from one open tile to another, 255 or more if there is no way there
+        # on mazes too big for a table of every pair it's an estimate that is never more than the real number
+        return self.compiled.path_distance(x1, y1, x2, y2)
+
+    def in_house(self, x, y):
+        return y * self.width + x in self.house_cells
+
+    def copy(self):
+        # the walls and exits never change so they are shared, only the tiles are copied
+        maze = copy.copy(self)
+        maze.tiles = [r[:] for r in self.tiles]
+        return maze
 
     def is_tile_wall(self, r, c):
         # checks if the given spot in the grid is a wall and return true or false
-        return self.tiles[r][c] == "#"
+        return not self.walkable[(r % self.height) * self.width + c % self.width]
 
 
 class Character:
+    # slots keep characters small and quick to copy, the sprites and sounds stay on the classes
+    __slots__ = ("game", "direction", "change_state_time", "x", "y", "state", "number")  # number in charList
+
     def __init__(self, game):
         self.game = game
         self.direction = STOP
@@ -288,21 +1135,20 @@ class Character:
 
     def move(self):
         self.direction = self.choose_direction()
-        # stores the proposed movement ie. -1 in x is left
-        move_x = self.direction[0]
-        move_y = self.direction[1]
-
-        # lets the characters loop around the screen
-        new_x = (self.x + move_x) % self.game.maze.width
-        if new_x < 0:
-            new_x = self.game.maze.width
-        new_y = (self.y + move_y) % self.game.maze.height
-        if new_y < 0:
-            new_y = self.game.maze.height
+        maze = self.game.maze
 
         # if the proposed position is not in a wall, the character is moved there
-        if not self.game.maze.is_tile_wall(new_y, new_x):
-            self.y, self.x = new_y, new_x
+        # the maze's neighbours already let the characters loop around the screen
+        new_pos = maze.neighbours[self.y * maze.width + self.x].get(self.direction)
+        if new_pos is not None:
+            occupants = self.game.occupants
+            here = occupants[(self.x, self.y)]
+            if len(here) == 1:
+                del occupants[(self.x, self.y)]
+            else:
+                here.remove(self)
+            self.x, self.y = new_pos
+            occupants.setdefault(new_pos, []).append(self)
         else:
             # the character is stopped
             self.direction = STOP
@@ -310,37 +1156,50 @@ class Character:
     def draw(self):
         # changes which dictionary of pictures to look at depending on the state
         if self.state == SCARED:
-            img = self.scared_sprites[self.direction]
+            img = self.scared_sprites.image(self.direction, self.game.tile_size)
         elif self.state == EATEN:
-            img = self.eaten_sprites[self.direction]
+            img = self.eaten_sprites.image(self.direction, self.game.tile_size)
         else:
-            img = self.sprites[self.direction]
+            img = self.sprites.image(self.direction, self.game.tile_size)
 
         # to make the sprite's movement smooth, the sprite is draw multiple incremanting the location it is drawn at
-        # times the number of ticks between movement times it's direction
+        # times the number of ticks between movement times it's direction (the last tick that ran is ticks - 1)
+        # plus how far the frame is towards the next tick
         # runs the moving forward animation if the next tile is not a wall
-        animation_increment = self.game.ticks % self.move_rate
-        if not self.game.maze.is_tile_wall(self.y + self.direction[1], self.x + self.direction[0]):
-            screen.blit(img,
-                        ((self.x * self.game.tile_size) + 3 * animation_increment * self.direction[0],
-                         (self.y * self.game.tile_size) + 3 * animation_increment * self.direction[1]))
+        # the sprites move 3 pixels a tick at the full tile size
+        animation_increment = (self.game.ticks - 1) % self.move_rate + self.game.interpolation
+        speed = 3 * self.game.tile_size / Game.tile_size
+        maze = self.game.maze
+        if maze.exits[self.y * maze.width + self.x] & DIRECTION_BITS[self.direction]:
+            return screen.blit(img,
+                               ((self.x * self.game.tile_size) + speed * animation_increment * self.direction[0],
+                                (self.y * self.game.tile_size) + speed * animation_increment * self.direction[1]))
         else:
             # if it is then the sprite is just draw regularly
-            screen.blit(img,
-                        ((self.x * self.game.tile_size),
-                         (self.y * self.game.tile_size)))
+            return screen.blit(img,
+                               ((self.x * self.game.tile_size),
+                                (self.y * self.game.tile_size)))
+
+    def copy(self, game):
+        # makes a copy of the character that belongs to another game
+        character = object.__new__(type(self))
+        for cls in type(self).__mro__[:-1]:
+            for name in cls.__slots__:
+                if hasattr(self, name):
+                    setattr(character, name, getattr(self, name))
+        character.game = game
+        return character
 
     def choose_state(self):
         # decides when to change states either by timer or location of the ghosts
-        next_states = {SCATTER: CHASE, CHASE: SCATTER, SCARED: CHASE}
-
+        # only called on ticks where Game.watch_states says a state could change
         if self.state in self.game.time_in_state:  # states that are timed:
             # if the timer has expired then switch to the next state
             if self.game.ticks >= self.change_state_time:
-                self.set_state(next_states[self.state])
+                self.set_state(NEXT_STATES[self.state])
 
         elif self.state == EATEN:
-            if self.game.maze.tiles[self.y][self.x] == "G":  # if they are in the ghost house
+            if self.game.maze.in_house(self.x, self.y):  # if they are in the ghost house
                 self.set_state(SCATTER)
 
     def set_state(self, new_state):
@@ -349,11 +1208,19 @@ class Character:
         if self.state in self.game.time_in_state:  # states that are timed:
             # sets the next time to change states
             self.change_state_time = self.game.ticks + self.game.time_in_state[self.state]
+            self.game.state_schedule.add((self,), self.change_state_time)
+        if self.state == EATEN:
+            # an eaten ghost checks every tick whether it has made it back to the ghost house
+            self.game.eaten.add(self)
+            self.game.watch_states = True
+        else:
+            self.game.eaten.discard(self)
         if self.state == SCARED:
             self.game.pac.num_ghosts_eaten = 0
 
 
 class Pacman(Character):
+    __slots__ = ("next_direction", "lives", "has_intersected_ghost", "num_ghosts_eaten", "total_ghosts_eaten")
     sprites = load_img("pac")
     # since pac and the ghosts use the same states
     # but ghosts require different images depending on their states pac also requires other image dictionaries
@@ -371,79 +1238,89 @@ class Pacman(Character):
 
     def __init__(self, game):
         Character.__init__(self, game)
-        self.key = None
+        self.next_direction = None  # the direction the player (or a simulation) is steering in
         self.lives = 3
         self.has_intersected_ghost = False
-        self.num_ghosts_eaten = 0
+        self.num_ghosts_eaten = 0  # since the last energizer, sets how many points the next ghost is worth
+        self.total_ghosts_eaten = 0  # over the whole game, never reset
 
     def set_start_pos(self):
         # starting position of pacman
-        self.x = 11
-        self.y = 18
+        self.x, self.y = self.game.maze.markers["pacman"]
 
     def set_key(self):
-        self.key = pygame.key.get_pressed()
+        # turns the pressed arrow key into the direction Pacman will take on his next move
+        key = pygame.key.get_pressed()
+        self.next_direction = None
+        if key[pygame.K_UP]:
+            self.next_direction = UP
+        elif key[pygame.K_DOWN]:
+            self.next_direction = DOWN
+        elif key[pygame.K_LEFT]:
+            self.next_direction = LEFT
+        elif key[pygame.K_RIGHT]:
+            self.next_direction = RIGHT
 
     def choose_direction(self):
         # changes the direction based on the key that was pressed
-
-        direction = self.direction
-        if self.key[pygame.K_UP]:
-            direction = UP
-        elif self.key[pygame.K_DOWN]:
-            direction = DOWN
-        elif self.key[pygame.K_LEFT]:
-            direction = LEFT
-        elif self.key[pygame.K_RIGHT]:
-            direction = RIGHT
-
-        return direction
+        if self.next_direction is None:
+            return self.direction
+        return self.next_direction
 
     def check_intersect(self):
         # checks if Pacman is in the same grid spot as an edible
         edible = self.game.edibles.get(self.game.maze.tiles[self.y][self.x])
         if edible is not None:
             if self.game.maze.tiles[self.y][self.x] == "@":  # if the edible is an energizer then change the state
-                for character in self.game.charList:
-                    character.set_state(SCARED)
+                self.game.scare_ghosts()
             # then adds to points plays noises accordingly
-            self.chomp.play()
+            self.game.play_sound(self.chomp)
             self.game.score += edible.POINTS
-            self.game.maze.tiles[self.y][self.x] = "_"  # removes the edible from the screen
-            self.game.maze.num_edibles -= 1
+            self.game.maze.remove_edible(self.x, self.y)  # removes the edible from the screen
+            self.game.clear_tile(self.x, self.y)
 
         # checks if Pacman is in the same grid spot as a cherry and it hasn't been caught yet
         if self.y == self.game.cherry.y and self.x == self.game.cherry.x and not self.game.caught_cherry:
             self.game.caught_cherry = True
             self.game.score += 200
-            self.fruit_eat_noise.play()
+            self.game.play_sound(self.fruit_eat_noise)
 
         self.check_ghost_intersect()
 
     def check_ghost_intersect(self):
         self.has_intersected_ghost = False
 
-        # checks if pac intersects with any character other than itself
-        for character in self.game.charList:
-            if character == self:
-                continue
-            if self.y == character.y and self.x == character.x and not self.has_intersected_ghost:
-                self.has_intersected_ghost = True
-                if character.state == SCARED:  # when he can eat ghosts
-                    # double the number of points are given each time a ghost is eaten
-                    self.num_ghosts_eaten += 1
-                    self.game.score += 100 * (2 ** self.num_ghosts_eaten)
-                    self.ghost_eat_noise.play()
-                    character.set_state(EATEN)
-                elif character.state == SCATTER or character.state == CHASE:  # when he cannot eat ghosts
-                    character.direction = STOP  # stops the characters from moving
-                    self.death_noise.play()
-                    self.lives -= 1
-                    self.game.reset_pos()
-                    pygame.time.wait(2000)  # gives the player 2 seconds of break before the game starts again
+        # checks if pac intersects with any character other than itself, only the first one in charList counts
+        occupants = self.game.occupants[(self.x, self.y)]
+        if len(occupants) > 1:
+            character = min((c for c in occupants if c is not self), key=lambda c: c.number)
+            self.has_intersected_ghost = True
+            if character.state == SCARED:  # when he can eat ghosts
+                # double the number of points are given each time a ghost is eaten
+                self.num_ghosts_eaten += 1
+                self.total_ghosts_eaten += 1
+                self.game.score += 100 * (2 ** self.num_ghosts_eaten)
+                self.game.play_sound(self.ghost_eat_noise)
+                character.set_state(EATEN)
+            elif character.state == SCATTER or character.state == CHASE:  # when he cannot eat ghosts
+                character.direction = STOP  # stops the characters from moving
+                self.game.play_sound(self.death_noise)
+                self.lives -= 1
+                # gives the player a break before the game starts again
+                self.game.pause_for_death((self.x, self.y))
+                self.game.reset_pos()
+
+    def draw_death(self):
+        # pacman shrinks away where he was caught while the game is paused
+        ts = self.game.tile_size
+        size = max(1, ts * self.game.death_pause_left // max(self.game.death_pause_ticks, 1))
+        img = pygame.transform.scale(self.sprites.image(self.direction, ts), (size, size))
+        x, y = self.game.death_pos
+        return screen.blit(img, (x * ts + (ts - size) // 2, y * ts + (ts - size) // 2))
 
 
 class Ghost(Character):
+    __slots__ = ("targetX", "targetY")
     move_rate = 10
     scared_sprites = load_img("scared")
     eaten_sprites = load_img("eyes")
@@ -455,48 +1332,56 @@ class Ghost(Character):
     def choose_direction(self):
         self.set_target()
 
+        # the maze's exits prevent ghosts from moving into a wall and the reversed direction is
+        # removed to prevent ghosts from moving backwards
+        maze = self.game.maze
+        exits = maze.exits[self.y * maze.width + self.x] & ~DIRECTION_BITS[REVERSED_DIRECTIONS[self.direction]]
+        if len(EXIT_DIRECTIONS[exits]) == 1:
+            # in a corridor or around a corner there's only one way to go, distances only matter where there's a choice
+            return EXIT_DIRECTIONS[exits][0]
+
         lowest_dist = 10000000
         best_direction = STOP
-        for direction in DIRECTIONS:
-            if direction == REVERSED_DIRECTIONS[self.direction]:  # prevents ghosts from moving backwards
-                continue
-            x, y = self.x + direction[0], self.y + direction[1]
-            if self.game.maze.is_tile_wall(y, x):  # prevents ghosts from moving into a wall
-                continue
-            else:
-                # calls distance for all tiles which the ghost can move into from it's current position
-                dist = self.distance(x, y)
-                if dist < lowest_dist:
-                    lowest_dist = dist
-                    best_direction = direction
+        for direction in EXIT_DIRECTIONS[exits]:
+            # calls distance for all tiles which the ghost can move into from it's current position
+            dist = self.distance(self.x + direction[0], self.y + direction[1])
+            if dist < lowest_dist:
+                lowest_dist = dist
+                best_direction = direction
         # returns the direction with the shortest distance to it's target
         return best_direction
 
     def distance(self, x, y):
         # calculates the distance of a given position to the ghosts target
+        if self.game.maze_aware_ghosts:
+            # the length of the shortest path through the maze, squared so it compares the same way
+            # as the straight line distance, targets off the maze or in a wall still use a straight line
+            maze = self.game.maze
+            if 0 <= self.targetX < maze.width and 0 <= self.targetY < maze.height and \
+                    maze.walkable[self.targetY * maze.width + self.targetX]:
+                return math.pow(maze.path_distance(x % maze.width, y % maze.height, self.targetX, self.targetY), 2)
         dist = math.pow(self.targetY - y, 2) + math.pow(self.targetX - x, 2)
         return dist
 
     def set_target(self):
         decided = True
-        if self.game.maze.tiles[self.y][self.x] == "G":
+        if self.game.maze.in_house(self.x, self.y):
             # if the ghosts are in the ghost houses sets the position directly above such that they are forced to exit
-            self.targetX = 11
-            self.targetY = 4
+            self.targetX, self.targetY = self.game.maze.markers["house_exit"]
         elif self.state == EATEN:
             # sends them to the ghost house
-            self.targetX = 11
-            self.targetY = 11
+            self.targetX, self.targetY = self.game.maze.markers["house"]
         elif self.state == SCARED:
             # makes them move in random directions
-            self.targetX = random.randint(0, 22)
-            self.targetY = random.randint(0, 24)
+            self.targetX = random.randint(0, self.game.maze.width - 1)
+            self.targetY = random.randint(0, self.game.maze.height - 1)
         else:
             decided = False
         return decided  # ensures that ghosts always have a target
 
 
 class Blinky(Ghost):
+    __slots__ = ()
     sprites = load_img("blinky")
 
     def __init__(self, game):
@@ -505,8 +1390,7 @@ class Blinky(Ghost):
 
     def set_start_pos(self):
         # starting position on the map
-        self.x = 11
-        self.y = 10
+        self.x, self.y = self.game.maze.markers["blinky"]
 
     def set_target(self):
         if Ghost.set_target(self):
@@ -514,8 +1398,7 @@ class Blinky(Ghost):
         decided = True
         if self.state == SCATTER:
             # if the state is scatter it will set the target to be it's corner on the map
-            self.targetX = 24
-            self.targetY = 1
+            self.targetX, self.targetY = self.game.maze.markers["blinky_corner"]
         elif self.state == CHASE:
             # targets Pacman directly
             self.targetX = self.game.pac.x
@@ -526,6 +1409,7 @@ class Blinky(Ghost):
 
 
 class Pinky(Ghost):
+    __slots__ = ()
     sprites = load_img("pinky")
 
     def __init__(self, game):
@@ -533,8 +1417,7 @@ class Pinky(Ghost):
 
     def set_start_pos(self):
         # starting position on the map
-        self.x = 11
-        self.y = 11
+        self.x, self.y = self.game.maze.markers["pinky"]
 
     def set_target(self):
         if Ghost.set_target(self):
@@ -542,8 +1425,7 @@ class Pinky(Ghost):
         decided = True
         if self.state == SCATTER:
             # if the state is scatter it will set the target to be it's corner on the map
-            self.targetX = 1
-            self.targetY = 1
+            self.targetX, self.targetY = self.game.maze.markers["pinky_corner"]
         elif self.state == CHASE:
             #  targets 4 tiles ahead of Pacman in the direction he is traveling
             self.targetX = self.game.pac.x + 4 * self.game.pac.direction[0]
@@ -554,6 +1436,7 @@ class Pinky(Ghost):
 
 
 class Inky(Ghost):
+    __slots__ = ()
     sprites = load_img("inky")
 
     def __init__(self, game):
@@ -561,8 +1444,7 @@ class Inky(Ghost):
 
     def set_start_pos(self):
         # starting position on the map
-        self.x = 10
-        self.y = 11
+        self.x, self.y = self.game.maze.markers["inky"]
 
     def set_target(self):
         if Ghost.set_target(self):
@@ -570,8 +1452,7 @@ class Inky(Ghost):
         decided = True
         if self.state == SCATTER:
             # if the state is scatter it will set the target to be it's corner on the map
-            self.targetX = 24
-            self.targetY = 22
+            self.targetX, self.targetY = self.game.maze.markers["inky_corner"]
         elif self.state == CHASE:
             # looks two tiles ahead of pacman and creates a vector from blinky
             vectorX = self.game.blinky.x - (self.game.pac.x + 2 * self.game.pac.direction[0])
@@ -585,6 +1466,7 @@ class Inky(Ghost):
 
 
 class Clyde(Ghost):
+    __slots__ = ()
     sprites = load_img("clyde")
 
     def __init__(self, game):
@@ -592,8 +1474,7 @@ class Clyde(Ghost):
 
     def set_start_pos(self):
         # starting position on the map
-        self.x = 12
-        self.y = 11
+        self.x, self.y = self.game.maze.markers["clyde"]
 
     def set_target(self):
         if Ghost.set_target(self):
@@ -601,21 +1482,44 @@ class Clyde(Ghost):
         decided = True
         if self.state == SCATTER:
             # if the state is scatter it will set the target to be it's corner on the map
-            self.targetX = 1
-            self.targetY = 22
+            self.targetX, self.targetY = self.game.maze.markers["clyde_corner"]
         elif self.state == CHASE:
             # targets Pacman directly
             # but if he is within a distance of 8 from Pacman then he goes back to his scatter position
             self.targetX = self.game.pac.x
             self.targetY = self.game.pac.y
             if self.distance(self.x, self.y) < 64:
-                self.targetX = 1
-                self.targetY = 22
+                self.targetX, self.targetY = self.game.maze.markers["clyde_corner"]
         else:
             decided = False
         return decided  # ensures that ghosts always have a target
 
 
-while True:
-    g = Game()
-    g.play()
+if __name__ == "__main__":
+    if "--build-atlas" in sys.argv:
+        # packs the sprites into one file for the game's tile size
+        open_window()
+        assets.build_atlas(Game.tile_size)
+        sys.exit()
+    if "--uncapped" in sys.argv:
+        MAX_FPS = 0
+    # python Main.py --maze FILE plays a maze file instead of the built in map
+    maze_file = sys.argv[sys.argv.index("--maze") + 1] if "--maze" in sys.argv else None
+    # and --ghosts N plays with N ghosts instead of 4
+    num_ghosts = int(sys.argv[sys.argv.index("--ghosts") + 1]) if "--ghosts" in sys.argv else 4
+    # and --db FILE saves every finished game's score in the high score table of a results store (see results.py)
+    high_scores = None
+    if "--db" in sys.argv:
+        from results import ResultsStore
+        high_scores = ResultsStore(sys.argv[sys.argv.index("--db") + 1])
+    while True:
+        g = Game(maze_file=maze_file, num_ghosts=num_ghosts)
+        if high_scores is not None:
+            g.high_score = high_scores.best_score()
+        g.play()
+        if g.pac.lives > 0:  # the window was closed rather than the game being lost
+            break
+        if high_scores is not None:
+            high_scores.add_high_score(g.score, g.level)
+    if high_scores is not None:
+        high_scores.close()
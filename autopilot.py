@@ -0,0 +1,283 @@
+# A bot that steers pacman by searching ahead with the game's own rules
+# run with: python autopilot.py --games 5 --budget 10   (plays headless games and reports how the search did)
+#           python autopilot.py --window                 (watch it play)
+# each decision is an expectimax search over pacman's moves, played out on a copy of the game, where scared
+# ghosts (the only random part of the game) are chance nodes sampled a few times
+# positions are hashed with Zobrist keys so the same position reached by a different path is only searched once
+import argparse
+import random
+import time
+from collections import OrderedDict
+
+from Main import Game, Pacman, EXIT_DIRECTIONS, DIRECTIONS, STOP, SCATTER, SCARED
+
+LEVEL_BONUS = 5000  # what clearing a level is worth on top of the points for it
+DEATH_PENALTY = 10000  # what losing a life costs
+DIRECTION_INDEX = {direction: i for i, direction in enumerate(DIRECTIONS + (STOP,))}
+MASK = 2 ** 64 - 1
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable:
+    # the values of positions that have been searched, at most size of them
+    # when it's full the least recently used entry is dropped, and an entry is only replaced by a search that
+    # went at least as deep as the one that made it
+    def __init__(self, size=200000):
+        self.size = size
+        self.entries = OrderedDict()  # key -> (depth, value)
+        self.lookups = 0
+        self.hits = 0
+
+    def get(self, key, depth):
+        self.lookups += 1
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < depth:
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, depth, value):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > depth:
+                return
+            self.entries.move_to_end(key)
+        elif len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        self.entries[key] = (depth, value)
+
+
+class Zobrist:
+    # a random 64 bit key for every pellet tile and every (character, tile, state, direction),
+    # a position's hash is all of its keys xored together so a move only changes the keys of what moved
+    # the rest of what decides how a position plays out (the tick, the state timers, lives, level...) changes
+    # on every move anyway, so it's hashed as a whole by counters_hash and mixed into the key for the table
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.keys = {}
+
+    def key(self, part):
+        key = self.keys.get(part)
+        if key is None:
+            key = self.keys[part] = self.rng.getrandbits(64)
+        return key
+
+    @staticmethod
+    def counters_hash(game):
+        # python's hash of a tuple of ints is the same in every run, unlike the hash of a string
+        return hash((game.ticks, game.pac.lives, game.level, game.pac.num_ghosts_eaten, game.caught_cherry,
+                     game.time_in_state[SCATTER], tuple(c.change_state_time for c in game.charList))) & MASK
+
+    @staticmethod
+    def characters(game):
+        width = game.maze.width
+        return tuple((c.y * width + c.x, c.state, DIRECTION_INDEX[c.direction]) for c in game.charList)
+
+    def full_hash(self, game):
+        value = 0
+        pellets = game.maze.pellets
+        while pellets:
+            bit = pellets & -pellets
+            value ^= self.key(bit.bit_length() - 1)
+            pellets ^= bit
+        for number, character in enumerate(self.characters(game)):
+            value ^= self.key((number,) + character)
+        return value
+
+    def update(self, value, old_pellets, old_characters, game):
+        # the hash after a move, from the hash before it and what was there before it
+        changed = old_pellets ^ game.maze.pellets
+        while changed:
+            bit = changed & -changed
+            value ^= self.key(bit.bit_length() - 1)
+            changed ^= bit
+        characters = self.characters(game)
+        for number, (old, new) in enumerate(zip(old_characters, characters)):
+            if old != new:
+                value ^= self.key((number,) + old) ^ self.key((number,) + new)
+        return value, characters
+
+
+class Autopilot:
+    # call it with a game to get the direction pacman should take, it searches for up to budget_ms milliseconds
+    # going a move deeper each time (up to max_depth) and uses the deepest search that finished
+    # with no budget it always searches to max_depth, so it plays the same way every time
+    def __init__(self, budget_ms=10, max_depth=8, chance_samples=2, table_size=200000):
+        self.budget = budget_ms / 1000 if budget_ms else None
+        self.max_depth = max_depth
+        self.chance_samples = chance_samples
+        self.table = TranspositionTable(table_size)
+        self.zobrist = Zobrist()
+        self.nodes = 0
+        self.search_time = 0
+        self.decisions = 0
+        self.depths = 0
+        self.direction = None
+
+    def __call__(self, game):
+        # only decides on the ticks pacman moves on, in between he keeps the direction he was given
+        if game.ticks % Pacman.move_rate != 0 or game.display_start_screen or game.death_pause_left > 0:
+            return self.direction
+        self.direction = self.decide(game)
+        return self.direction
+
+    def decide(self, game):
+        start = time.perf_counter()
+        self.deadline = start + self.budget if self.budget else float("inf")
+        # the search is played out on a copy of the game which is never drawn, makes no sound and has no pause
+        # after a death, the random module is put back afterwards so the real game plays out as it would have
+        random_state = random.getstate()
+        sim = game.clone()
+        sim.headless = True
+        sim.death_pause_ticks = 0
+        root_hash = self.zobrist.full_hash(sim)
+        root = (sim.snapshot(), root_hash, self.zobrist.characters(sim))
+        best_direction = self.moves(sim)[0]
+        try:
+            for depth in range(1, self.max_depth + 1):
+                best_direction = self.search_root(sim, root, depth)
+                self.depths += 1
+        except SearchTimeout:
+            pass
+        random.setstate(random_state)
+        self.search_time += time.perf_counter() - start
+        self.decisions += 1
+        return best_direction
+
+    def moves(self, game):
+        # the directions pacman can actually go from his tile
+        maze = game.maze
+        return EXIT_DIRECTIONS[maze.exits[game.pac.y * maze.width + game.pac.x]] or (STOP,)
+
+    def search_root(self, sim, root, depth):
+        state, value, characters = root
+        best_direction, best_value = None, None
+        for direction in self.moves(sim):
+            result = self.chance(sim, root, direction, depth)
+            sim.restore(state)
+            if best_value is None or result > best_value:
+                best_direction, best_value = direction, result
+        return best_direction
+
+    def search(self, sim, node, depth):
+        # the best value pacman can get from here within depth more moves
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        state, value, characters = node
+        key = value ^ self.zobrist.counters_hash(sim)
+        stored = self.table.get(key, depth)
+        if stored is not None:
+            return stored
+        if depth == 0 or sim.done:
+            result = self.evaluate(sim)
+        else:
+            result = None
+            for direction in self.moves(sim):
+                move_value = self.chance(sim, node, direction, depth)
+                sim.restore(state)
+                if result is None or move_value > result:
+                    result = move_value
+        self.table.put(key, depth, result)
+        return result
+
+    def chance(self, sim, node, direction, depth):
+        # the average value of making a move, scared ghosts wander randomly so the move is tried with a few
+        # different random numbers, otherwise the move always plays out the same and is only tried once
+        state, value, characters = node
+        samples = self.chance_samples if any(c.state == SCARED for c in sim.charList) else 1
+        total = 0
+        for sample in range(samples):
+            if sample:
+                sim.restore(state)
+            random.seed(value ^ sample)
+            reward = self.play_move(sim, direction)
+            child_value, child_characters = self.zobrist.update(value, state.pellets, characters, sim)
+            total += reward + self.search(sim, (sim.snapshot(), child_value, child_characters), depth - 1)
+        return total / samples
+
+    def play_move(self, sim, direction):
+        # runs the game until pacman's next move and returns what it was worth
+        score, level, lives = sim.score, sim.level, sim.pac.lives
+        sim.step(direction)
+        while sim.ticks % Pacman.move_rate != 0 and not sim.done:
+            sim.step()
+        return sim.score - score + LEVEL_BONUS * (sim.level - level) - DEATH_PENALTY * (lives - sim.pac.lives)
+
+    def evaluate(self, sim):
+        # how good a position is apart from the points already scored: closer to the nearest edible is better
+        maze = sim.maze
+        start = (sim.pac.x, sim.pac.y)
+        seen = {start}
+        frontier = [start]
+        steps = 0
+        while frontier:
+            next_frontier = []
+            for x, y in frontier:
+                if maze.tiles[y][x] in Game.edibles:
+                    return -steps
+                for tile in maze.neighbours[y * maze.width + x].values():
+                    if tile not in seen:
+                        seen.add(tile)
+                        next_frontier.append(tile)
+            frontier = next_frontier
+            steps += 1
+        return 0
+
+    def stats(self):
+        return {"decisions": self.decisions, "nodes": self.nodes,
+                "nodes_per_sec": self.nodes / max(self.search_time, 1e-9),
+                "table_hit_rate": self.table.hits / max(self.table.lookups, 1),
+                "table_entries": len(self.table.entries),
+                "average_depth": self.depths / max(self.decisions, 1),
+                "ms_per_decision": self.search_time / max(self.decisions, 1) * 1000}
+
+
+# for runner.py (python runner.py --policy autopilot:policy), episodes there have to play out the same every time
+# they're run with the same seed, so it searches to a fixed depth instead of for a time and each game gets a new
+# autopilot so nothing is carried over from the episode before, depth 3 takes about as long as the 10ms budget
+POLICY_DEPTH = 3
+policy_game = None
+policy_autopilot = None
+
+
+def policy(game, rng):
+    global policy_game, policy_autopilot
+    if game is not policy_game:
+        policy_game = game
+        policy_autopilot = Autopilot(budget_ms=0, max_depth=POLICY_DEPTH)
+    return policy_autopilot(game)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lets a search play Pacman")
+    parser.add_argument("--games", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=float, default=10, help="milliseconds of search per move (0 for no limit)")
+    parser.add_argument("--max-depth", type=int, default=8)
+    parser.add_argument("--max-ticks", type=int, default=20000)
+    parser.add_argument("--window", action="store_true", help="play one game in the window")
+    args = parser.parse_args()
+
+    autopilot = Autopilot(args.budget, args.max_depth)
+    if args.window:
+        game = Game()
+        game.autopilot = autopilot
+        game.play()
+    else:
+        for seed in range(args.seed, args.seed + args.games):
+            random.seed(seed)
+            game = Game(headless=True)
+            while not game.done and game.ticks < args.max_ticks:
+                game.step(autopilot(game))
+            print("seed %d: score %d, level %d, %d ticks" % (seed, game.score, game.level, game.ticks))
+    for name, value in autopilot.stats().items():
+        print("%-16s %12.2f" % (name, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# Runs many games of Pacman at once
+# every game is stepped in lockstep and all of their state is held in numpy arrays,
+# the rules are the same as the ones in Main.py so a game seeded the same way plays out the same
+import random
+import numpy as np
+
+from Main import (Maze, Pacman, Ghost, PacDot, Energizer, UP, DOWN, LEFT, RIGHT, STOP, DIRECTION_BITS,
+                  REVERSED_DIRECTIONS, SCATTER, CHASE, SCARED, EATEN)
+
+# directions are stored as indexes into this tuple, the first four are in the order the ghosts try them
+DIRECTION_LIST = (UP, DOWN, LEFT, RIGHT, STOP)
+DIR_UP, DIR_DOWN, DIR_LEFT, DIR_RIGHT, DIR_STOP = range(5)
+KEEP_DIRECTION = -1  # action that lets pacman carry on in the direction he is going
+DX = np.array([d[0] for d in DIRECTION_LIST])
+DY = np.array([d[1] for d in DIRECTION_LIST])
+BITS = np.array([DIRECTION_BITS[d] for d in DIRECTION_LIST])
+REVERSED = np.array([DIRECTION_LIST.index(REVERSED_DIRECTIONS[d]) for d in DIRECTION_LIST])
+
+# the ghosts in the order they move (the same order as Game.charList)
+BLINKY, PINKY, INKY, CLYDE = range(4)
+NUM_GHOSTS = 4
+GHOST_NAMES = ("blinky", "pinky", "inky", "clyde")  # the names of their markers in the maze
+GHOST_START_DIRECTIONS = (DIR_UP, DIR_STOP, DIR_STOP, DIR_STOP)
+
+# the same timings as Game.time_in_state, in ticks
+TIME_IN_STATE = {SCATTER: 7 * 60, CHASE: 20 * 60, SCARED: 10 * 60}
+# the state each timed state changes to once its time is up (EATEN is not timed)
+NEXT_STATE = np.array([CHASE, SCATTER, CHASE, EATEN])
+POINTS = np.array([0, PacDot.POINTS, Energizer.POINTS])  # indexed by what is on a tile, nothing/dot/energizer
+NO_PELLET, DOT, ENERGIZER = range(3)
+
+
+class BatchGame:
+    ghost_move_rate = Ghost.move_rate
+    pac_move_rate = Pacman.move_rate
+
+    def __init__(self, n, seeds=None, maze_file=None):
+        self.n = n
+        self.index = np.arange(n)
+        # every game gets its own random number generator, seeded like random.seed(seed) would seed a Game
+        if seeds is None:
+            seeds = range(n)
+        self.rngs = [random.Random(seed) for seed in seeds]
+
+        # everything about the maze that doesn't change is shared by all the games
+        maze = Maze(maze_file)
+        maze.load_map()
+        self.width, self.height = maze.width, maze.height
+        # the same positions and targets the characters in Main.py take from the maze's markers
+        self.pac_start = maze.markers["pacman"]
+        self.ghost_starts = [maze.markers[name] for name in GHOST_NAMES]
+        self.scatter_corners = [maze.markers[name + "_corner"] for name in GHOST_NAMES]
+        self.house_exit = maze.markers["house_exit"]
+        self.house = maze.markers["house"]
+        tiles = np.array([list(row) for row in maze.tiles])
+        self.exits = np.frombuffer(bytes(maze.exits), np.uint8).reshape(maze.height, maze.width)
+        self.is_house = np.zeros(maze.width * maze.height, bool)
+        self.is_house[list(maze.house_cells)] = True
+        self.is_house = self.is_house.reshape(maze.height, maze.width)
+        self.empty = tiles == "_"  # tiles that are empty before anything is eaten
+        self.start_pellets = np.zeros(tiles.shape, np.uint8)
+        self.start_pellets[tiles == "*"] = DOT
+        self.start_pellets[tiles == "@"] = ENERGIZER
+        self.start_num_edibles = int(np.count_nonzero(self.start_pellets))
+        # the tile each direction leads to from every tile, the tunnel wraps around
+        ys, xs = np.mgrid[0:maze.height, 0:maze.width]
+        self.next_x = (xs[..., None] + DX) % maze.width
+        self.next_y = (ys[..., None] + DY) % maze.height
+
+        self.ticks = 0
+        self.display_start_screen = True
+        self.done = np.zeros(n, bool)
+        self.game_ticks = np.zeros(n, np.int64)  # ticks played by each game before it ended
+        self.score = np.zeros(n, np.int64)
+        self.level = np.ones(n, np.int64)
+        self.lives = np.full(n, 3, np.int64)
+        self.pellets = np.repeat(self.start_pellets[None], n, axis=0)
+        self.num_edibles = np.full(n, self.start_num_edibles, np.int64)
+        self.time_scatter = np.full(n, TIME_IN_STATE[SCATTER], np.int64)
+
+        self.pac_x = np.full(n, self.pac_start[0], np.int64)
+        self.pac_y = np.full(n, self.pac_start[1], np.int64)
+        self.pac_dir = np.full(n, DIR_STOP, np.int64)
+        self.num_ghosts_eaten = np.zeros(n, np.int64)
+
+        self.ghost_x = np.tile(np.array([start[0] for start in self.ghost_starts]), (n, 1))
+        self.ghost_y = np.tile(np.array([start[1] for start in self.ghost_starts]), (n, 1))
+        self.ghost_dir = np.tile(np.array(GHOST_START_DIRECTIONS), (n, 1))
+        self.ghost_state = np.full((n, NUM_GHOSTS), SCATTER, np.int64)
+        self.change_state_time = np.full((n, NUM_GHOSTS), TIME_IN_STATE[SCATTER], np.int64)
+
+        self.caught_cherry = np.zeros(n, bool)
+        self.cherry_x = np.zeros(n, np.int64)
+        self.cherry_y = np.zeros(n, np.int64)
+        for i in self.index:
+            self.generate_cherry_pos(i)
+
+    def generate_cherry_pos(self, i):
+        # the same random numbers Cherry.generate_random_pos would draw
+        self.cherry_x[i] = self.rngs[i].randint(0, self.width - 1)
+        self.cherry_y[i] = self.rngs[i].randint(0, self.height - 1)
+
+    def step(self, actions=None):
+        # advances every game by one tick, actions holds the index of the direction pacman is steered in
+        # for each game (KEEP_DIRECTION keeps his direction), games that have ended are left as they are
+        if actions is None:
+            actions = np.full(self.n, KEEP_DIRECTION)
+        active = ~self.done
+
+        self.update_cherry(active)
+        if self.display_start_screen:
+            if self.ticks > 4 * 60:
+                self.display_start_screen = False
+        else:
+            # the characters take turns in the same order as Game.charList, pacman is checked after each one
+            for ghost in range(NUM_GHOSTS):
+                self.choose_state(ghost, active)
+                if self.ticks % self.ghost_move_rate == 0:
+                    self.move_ghost(ghost, active)
+                self.check_intersect(active)
+            if self.ticks % self.pac_move_rate == 0:
+                self.move_pac(np.asarray(actions), active)
+            self.check_intersect(active)
+
+        self.done |= active & (self.lives < 1)
+        cleared = active & ~self.done & (self.num_edibles == 0)
+        if cleared.any():
+            self.level_up(cleared)
+
+        self.game_ticks += active
+        self.ticks += 1
+        return self.done
+
+    def update_cherry(self, active):
+        # moves the cherry of every game that has it placed somewhere other than an empty tile
+        on_empty = self.empty[self.cherry_y, self.cherry_x] | (
+            (self.start_pellets[self.cherry_y, self.cherry_x] != NO_PELLET)
+            & (self.pellets[self.index, self.cherry_y, self.cherry_x] == NO_PELLET))
+        for i in np.flatnonzero(active & (self.score > 700) & ~self.caught_cherry & ~on_empty):
+            self.generate_cherry_pos(i)
+
+    def set_timed_state(self, ghost, games, new_state):
+        # like Character.set_state for the timed states
+        self.ghost_state[games, ghost] = new_state
+        time_in_state = np.where(new_state == SCATTER, self.time_scatter[games],
+                                 np.where(new_state == CHASE, TIME_IN_STATE[CHASE], TIME_IN_STATE[SCARED]))
+        self.change_state_time[games, ghost] = self.ticks + time_in_state
+
+    def choose_state(self, ghost, active):
+        state = self.ghost_state[:, ghost]
+        expired = active & (state != EATEN) & (self.ticks >= self.change_state_time[:, ghost])
+        home = active & (state == EATEN) & self.is_house[self.ghost_y[:, ghost], self.ghost_x[:, ghost]]
+        if expired.any():
+            self.set_timed_state(ghost, expired, NEXT_STATE[state[expired]])
+        if home.any():
+            self.set_timed_state(ghost, home, SCATTER)
+
+    def set_target(self, ghost, active):
+        # works out every game's target for one ghost, following Ghost.set_target and the ghost's own set_target
+        x, y = self.ghost_x[:, ghost], self.ghost_y[:, ghost]
+        state = self.ghost_state[:, ghost]
+        pac_dx, pac_dy = DX[self.pac_dir], DY[self.pac_dir]
+
+        if ghost == BLINKY:
+            chase_x, chase_y = self.pac_x, self.pac_y
+        elif ghost == PINKY:
+            chase_x, chase_y = self.pac_x + 4 * pac_dx, self.pac_y + 4 * pac_dy
+        elif ghost == INKY:
+            blinky_x, blinky_y = self.ghost_x[:, BLINKY], self.ghost_y[:, BLINKY]
+            chase_x = blinky_x + 2 * (blinky_x - (self.pac_x + 2 * pac_dx))
+            chase_y = blinky_y + 2 * (blinky_y - (self.pac_y + 2 * pac_dy))
+        else:
+            # clyde goes back to his corner when he's within 8 tiles of pacman
+            near = (self.pac_y - y) ** 2 + (self.pac_x - x) ** 2 < 64
+            chase_x = np.where(near, self.scatter_corners[CLYDE][0], self.pac_x)
+            chase_y = np.where(near, self.scatter_corners[CLYDE][1], self.pac_y)
+
+        target_x = np.where(state == SCATTER, self.scatter_corners[ghost][0], chase_x)
+        target_y = np.where(state == SCATTER, self.scatter_corners[ghost][1], chase_y)
+        # ghosts in the ghost house are sent out of it whatever state they're in
+        leaving = self.is_house[y, x]
+        target_x = np.where(leaving, self.house_exit[0], np.where(state == EATEN, self.house[0], target_x))
+        target_y = np.where(leaving, self.house_exit[1], np.where(state == EATEN, self.house[1], target_y))
+        # scared ghosts wander to random tiles, drawn from each game's own generator
+        for i in np.flatnonzero(active & ~leaving & (state == SCARED)):
+            target_x[i] = self.rngs[i].randint(0, self.width - 1)
+            target_y[i] = self.rngs[i].randint(0, self.height - 1)
+        return target_x, target_y
+
+    def move_ghost(self, ghost, active):
+        target_x, target_y = self.set_target(ghost, active)
+        x, y = self.ghost_x[:, ghost], self.ghost_y[:, ghost]
+        direction = self.ghost_dir[:, ghost]
+
+        # like Ghost.choose_direction, the closest open tile to the target that isn't backwards is picked,
+        # argmin picks the first of equally close tiles just like the loop over DIRECTIONS does
+        exits = self.exits[y, x] & ~BITS[REVERSED[direction]]
+        allowed = (exits[:, None] & BITS[:4]) != 0
+        dist = (target_y[:, None] - (y[:, None] + DY[:4])) ** 2 + (target_x[:, None] - (x[:, None] + DX[:4])) ** 2
+        best = np.where(allowed, dist, np.iinfo(np.int64).max).argmin(axis=1)
+        best = np.where(allowed.any(axis=1), best, DIR_STOP)
+
+        best = np.where(active, best, direction)
+        self.ghost_x[:, ghost] = self.next_x[y, x, best]
+        self.ghost_y[:, ghost] = self.next_y[y, x, best]
+        self.ghost_dir[:, ghost] = best
+
+    def move_pac(self, actions, active):
+        # like Pacman.choose_direction and Character.move
+        direction = np.where(active & (actions != KEEP_DIRECTION), actions, self.pac_dir)
+        direction = np.where((self.exits[self.pac_y, self.pac_x] & BITS[direction]) != 0, direction, DIR_STOP)
+        direction = np.where(active, direction, self.pac_dir)
+        x, y = self.pac_x, self.pac_y
+        self.pac_x, self.pac_y = self.next_x[y, x, direction], self.next_y[y, x, direction]
+        self.pac_dir = direction
+
+    def check_intersect(self, active):
+        # like Pacman.check_intersect, runs after every character has had its turn
+        kind = self.pellets[self.index, self.pac_y, self.pac_x]
+        eating = active & (kind != NO_PELLET)
+        if eating.any():
+            energized = eating & (kind == ENERGIZER)
+            if energized.any():
+                self.ghost_state[energized] = SCARED
+                self.change_state_time[energized] = self.ticks + TIME_IN_STATE[SCARED]
+                self.num_ghosts_eaten[energized] = 0
+            self.score[eating] += POINTS[kind[eating]]
+            self.pellets[self.index[eating], self.pac_y[eating], self.pac_x[eating]] = NO_PELLET
+            self.num_edibles[eating] -= 1
+
+        caught = active & ~self.caught_cherry & (self.pac_x == self.cherry_x) & (self.pac_y == self.cherry_y)
+        if caught.any():
+            self.caught_cherry |= caught
+            self.score[caught] += 200
+
+        same_tile = active[:, None] & (self.ghost_x == self.pac_x[:, None]) & (self.ghost_y == self.pac_y[:, None])
+        if same_tile.any():
+            self.check_ghost_intersect(same_tile)
+
+    def check_ghost_intersect(self, same_tile):
+        # like Pacman.check_ghost_intersect, only the first ghost on pacman's tile counts
+        has_intersected = np.zeros(self.n, bool)
+        for ghost in range(NUM_GHOSTS):
+            hit = same_tile[:, ghost] & ~has_intersected
+            if not hit.any():
+                continue
+            has_intersected |= hit
+            state = self.ghost_state[:, ghost]
+            eaten = hit & (state == SCARED)
+            killed = hit & ((state == SCATTER) | (state == CHASE))
+
+            # double the number of points are given each time a ghost is eaten
+            self.num_ghosts_eaten[eaten] += 1
+            self.score[eaten] += 100 * 2 ** self.num_ghosts_eaten[eaten]
+            state[eaten] = EATEN
+
+            self.ghost_dir[killed, ghost] = DIR_STOP
+            self.lives[killed] -= 1
+            self.reset_pos(killed)
+            # everyone is back at their start so nothing else can be on pacman's tile
+            same_tile[killed] = False
+
+    def reset_pos(self, games):
+        self.pac_x[games], self.pac_y[games] = self.pac_start
+        for ghost, start in enumerate(self.ghost_starts):
+            self.ghost_x[games, ghost], self.ghost_y[games, ghost] = start
+
+    def level_up(self, games):
+        # like Game.level_up, the ghosts go back to scatter without their timers being reset
+        self.level[games] += 1
+        self.reset_pos(games)
+        self.pellets[games] = self.start_pellets
+        self.num_edibles[games] = self.start_num_edibles
+        self.caught_cherry[games] = False
+        self.ghost_state[games] = SCATTER
+        self.time_scatter[games & (self.level >= 2) & (self.level <= 5)] = 3
+        self.time_scatter[games & (self.level > 5)] = 1
@@ -0,0 +1,536 @@
+# Benchmarks for the Pacman game
+# run with: python benchmark.py [--out results.json] [--baseline old.json] [--tolerance 0.1]
+# --out saves every result, --baseline compares against a saved run and fails if anything got slower
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+
+import headless  # before Main, so no window or sound card is opened
+import pygame
+import Main
+from Main import Game, Blinky, Pinky, Inky, Clyde, UP, DOWN, LEFT, RIGHT, CHASE
+
+# pacman changes direction every so often so the game keeps moving
+SCRIPTED_DIRECTIONS = (LEFT, UP, RIGHT, DOWN)
+
+
+def scripted_direction(ticks):
+    return SCRIPTED_DIRECTIONS[(ticks // 120) % len(SCRIPTED_DIRECTIONS)]
+
+
+def full_redraw(game):
+    # the original renderer, every wall and dot is drawn again each frame and the whole window is flipped
+    Main.screen.fill(Main.BLACK)
+    game.draw_walls(Main.screen)
+    game.draw_dots(Main.screen)
+    if game.cherry_visible():
+        game.cherry.draw()
+    game.game_text()
+    if game.display_start_screen:
+        game.start_screen()
+    else:
+        for character in game.charList:
+            character.draw()
+    pygame.display.flip()
+
+
+def cached_redraw(game):
+    # the renderer used by the game, only the parts of the window that changed are redrawn
+    pygame.display.update(game.draw())
+
+
+def bench_render(frames=2000):
+    # average time per frame in microseconds for each renderer over the same game
+    Main.open_window()
+    results = {}
+    for name, render in (("full_redraw", full_redraw), ("cached_redraw", cached_redraw)):
+        game = Game(headless=True)
+        total = 0
+        for frame in range(frames):
+            if game.step(scripted_direction(game.ticks)):
+                game = Game(headless=True)
+            start = time.perf_counter()
+            render(game)
+            total += time.perf_counter() - start
+        results[name] = total / frames * 1e6
+    return results
+
+
+def bench_batch(sizes=(1, 16, 256, 1024), ticks=2000):
+    # game-ticks per second of BatchGame for different numbers of games, pacman moves randomly
+    import numpy as np
+    from batch import BatchGame
+    results = {}
+    for n in sizes:
+        game = BatchGame(n)
+        rng = np.random.default_rng(0)
+        start = time.perf_counter()
+        for tick in range(ticks):
+            game.step(rng.integers(0, 4, n))
+        results[n] = n * ticks / (time.perf_counter() - start)
+    return results
+
+
+def bench_headless(ticks=20000, attach=None):
+    # ticks per second of a single headless Game, attach is called with every new game
+    game = Game(headless=True)
+    if attach is not None:
+        attach(game)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        if game.step(scripted_direction(game.ticks)):
+            game = Game(headless=True)
+            if attach is not None:
+                attach(game)
+    return ticks / (time.perf_counter() - start)
+
+
+def bench_telemetry(ticks=200000):
+    # headless ticks per second with and without every tick being logged
+    import tempfile
+    from telemetry import Telemetry
+    results = {"without": bench_headless(ticks)}
+    with tempfile.TemporaryDirectory() as path:
+        sink = Telemetry(path)
+        results["with"] = bench_headless(ticks, sink.attach)
+        sink.close()
+    return results
+
+
+def bench_clone(count=20000):
+    # snapshots, restores and clones per second partway through a game
+    game = Game(headless=True)
+    while game.ticks < 2000:
+        game.step(scripted_direction(game.ticks))
+    results = {}
+    start = time.perf_counter()
+    for i in range(count):
+        state = game.snapshot()
+    results["snapshot"] = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(count):
+        game.restore(state)
+    results["restore"] = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(count):
+        game.clone()
+    results["clone"] = count / (time.perf_counter() - start)
+    return results
+
+
+def bench_ghost_types(rounds=20000):
+    # Ghost.choose_direction calls per second for each kind of ghost on its own, chasing pacman from
+    # the same spread of tiles so the four results can be compared
+    results = {}
+    game = Game(headless=True)
+    tiles = [(x, y) for y in range(game.maze.height) for x in range(game.maze.width)
+             if not game.maze.is_tile_wall(y, x)]
+    for cls in (Blinky, Pinky, Inky, Clyde):
+        ghost = cls(game)
+        ghost.state = CHASE
+        rng = random.Random(0)
+        positions = [rng.choice(tiles) for i in range(256)]
+        start = time.perf_counter()
+        for i in range(rounds):
+            ghost.x, ghost.y = positions[i % 256]
+            ghost.choose_direction()
+        results[cls.__name__] = rounds / (time.perf_counter() - start)
+    return results
+
+
+def pellet_seeker(game):
+    # steers pacman along the shortest path to the nearest edible, ignoring the ghosts
+    maze = game.maze
+    start = (game.pac.x, game.pac.y)
+    first_moves = {start: None}
+    frontier = deque([start])
+    while frontier:
+        x, y = frontier.popleft()
+        if maze.tiles[y][x] in Game.edibles:
+            return first_moves[(x, y)]
+        for direction, tile in maze.neighbours[y * maze.width + x].items():
+            if tile not in first_moves:
+                first_moves[tile] = first_moves[(x, y)] or direction
+                frontier.append(tile)
+    return None
+
+
+def bench_level(seeds=range(5), spare_lives=1000):
+    # milliseconds and ticks for a scripted pacman to clear the first level, averaged over a few seeded games,
+    # the ghosts still catch him so he's given spare lives to always finish, how many he lost is reported too
+    seconds = ticks = lives_lost = 0
+    for seed in seeds:
+        random.seed(seed)
+        game = Game(headless=True)
+        game.pac.lives = spare_lives
+        start = time.perf_counter()
+        while game.level == 1:
+            game.step(pellet_seeker(game) if game.ticks % game.pac.move_rate == 0 else None)
+        seconds += time.perf_counter() - start
+        ticks += game.ticks
+        lives_lost += spare_lives - game.pac.lives
+    return {"time": seconds / len(seeds) * 1e3, "ticks": ticks / len(seeds), "lives_lost": lives_lost / len(seeds)}
+
+
+def bench_ghost_decisions(counts=(4, 16, 64, 256), rounds=200):
+    # microseconds per Ghost.choose_direction call for different numbers of chasing ghosts,
+    # with straight line and maze aware distances
+    results = {}
+    for maze_aware in (False, True):
+        game = Game(headless=True, maze_aware_ghosts=maze_aware)
+        tiles = [(x, y) for y in range(game.maze.height) for x in range(game.maze.width)
+                 if not game.maze.is_tile_wall(y, x)]
+        rng = random.Random(0)
+        for count in counts:
+            ghosts = [(Blinky, Pinky, Inky, Clyde)[i % 4](game) for i in range(count)]
+            for ghost in ghosts:
+                ghost.x, ghost.y = rng.choice(tiles)
+                ghost.state = CHASE
+            start = time.perf_counter()
+            for i in range(rounds):
+                for ghost in ghosts:
+                    ghost.choose_direction()
+            results[("maze_aware" if maze_aware else "straight", count)] = \
+                (time.perf_counter() - start) / (rounds * count) * 1e6
+    return results
+
+
+def generate_maze(size):
+    # a square maze file with a pillar on every other tile of every other row, so there are crossroads
+    # everywhere, with a three tile ghost house in the middle and energizers in the corners
+    # size has to be 3 more than a multiple of 4 so the middle row and column are open
+    middle = size // 2
+    rows = []
+    for y in range(size):
+        row = ""
+        for x in range(size):
+            if x in (0, size - 1) or y in (0, size - 1) or (x % 2 == 0 and y % 2 == 0):
+                row += "#"
+            elif y == middle and abs(x - middle) <= 1:
+                row += "G"
+            elif (x, y) in ((1, 1), (size - 2, 1), (1, size - 2), (size - 2, size - 2)):
+                row += "@"
+            else:
+                row += "*"
+        rows.append(row)
+    markers = {"pacman": (1, size - 2), "blinky": (middle, middle), "pinky": (middle - 1, middle),
+               "inky": (middle + 1, middle), "clyde": (middle, middle), "house_exit": (middle, middle - 2),
+               "house": (middle, middle)}
+    return "\n".join(rows) + "\n\n" + "\n".join("%s %d %d" % (name, x, y) for name, (x, y) in markers.items())
+
+
+def bench_mazes(sizes=(23, 103, 303), ticks=5000, frames=500):
+    # for generated mazes of each size: milliseconds to compile the maze and to load it back from the cache,
+    # then headless ticks per second with straight line and maze aware ghosts and microseconds per drawn frame,
+    # none of which should depend on the size
+    import tempfile
+    results = {}
+    Main.open_window()
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = Main.CompiledMaze.CACHE_DIR
+        Main.CompiledMaze.CACHE_DIR = directory
+        try:
+            for size in sizes:
+                path = os.path.join(directory, "maze_%d.txt" % size)
+                with open(path, "w") as f:
+                    f.write(generate_maze(size))
+                start = time.perf_counter()
+                Game(headless=True, maze_file=path)
+                results[(size, "compile")] = (time.perf_counter() - start) * 1e3
+                Main.CompiledMaze.loaded.clear()
+                start = time.perf_counter()
+                game = Game(headless=True, maze_file=path)
+                results[(size, "load")] = (time.perf_counter() - start) * 1e3
+                start = time.perf_counter()
+                for tick in range(ticks):
+                    game.step(scripted_direction(game.ticks))
+                results[(size, "ticks")] = ticks / (time.perf_counter() - start)
+                aware = Game(headless=True, maze_file=path, maze_aware_ghosts=True)
+                start = time.perf_counter()
+                for tick in range(ticks):
+                    aware.step(scripted_direction(aware.ticks))
+                results[(size, "aware_ticks")] = ticks / (time.perf_counter() - start)
+                game.draw()  # the first frame draws the whole maze
+                total = 0
+                for frame in range(frames):
+                    game.step(scripted_direction(game.ticks))
+                    start = time.perf_counter()
+                    pygame.display.update(game.draw())
+                    total += time.perf_counter() - start
+                results[(size, "frame")] = total / frames * 1e6
+        finally:
+            Main.CompiledMaze.CACHE_DIR = cache_dir
+            Main.CompiledMaze.loaded.clear()
+    return results
+
+
+def bench_swarm(counts=(4, 16, 64, 256), size=103, ticks=2000):
+    # microseconds per tick, and per tick per character, for growing numbers of ghosts on a generated maze,
+    # the time per character should stay about the same as the swarm grows
+    import tempfile
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "swarm.txt")
+        with open(path, "w") as f:
+            f.write(generate_maze(size))
+        for count in counts:
+            random.seed(0)
+            game = Game(headless=True, maze_file=path, num_ghosts=count)
+            game.pac.lives = ticks  # so the swarm can't end the game
+            while game.display_start_screen:
+                game.step()
+            start = time.perf_counter()
+            for tick in range(ticks):
+                game.step(scripted_direction(game.ticks))
+            tick_time = (time.perf_counter() - start) / ticks * 1e6
+            results[(count, "tick")] = tick_time
+            results[(count, "character")] = tick_time / (count + 1)
+    return results
+
+
+def bench_env(steps=5000, vector_sizes=(8, 32)):
+    # microseconds per environment step and how much of that is spent updating the observation,
+    # then steps per second of vector environments spread over the cores
+    import numpy as np
+    from env import PacmanEnv, VectorEnv
+    results = {}
+    environment = PacmanEnv()
+    rng = random.Random(0)
+    step_time = 0
+    environment.reset(0)
+    for i in range(steps):
+        start = time.perf_counter()
+        observation, reward, terminated, truncated, info = environment.step(rng.randrange(5))
+        step_time += time.perf_counter() - start
+        if terminated or truncated:
+            environment.reset()
+    # the same again with the observation updated separately so it can be timed on its own
+    update = environment.update_observation
+    environment.update_observation = lambda: None
+    observation_time = 0
+    environment.reset(0)
+    for i in range(steps):
+        observation, reward, terminated, truncated, info = environment.step(rng.randrange(5))
+        start = time.perf_counter()
+        update()
+        observation_time += time.perf_counter() - start
+        if terminated or truncated:
+            environment.reset()
+    results["step"] = step_time / steps * 1e6
+    results["observation"] = observation_time / steps * 1e6
+    for n in vector_sizes:
+        vector = VectorEnv(n)
+        vector.reset(0)
+        actions = np.random.default_rng(0).integers(0, 5, (steps // 10, n))
+        start = time.perf_counter()
+        for step_actions in actions:
+            vector.step(step_actions)
+        results["vector%d" % n] = len(actions) * n / (time.perf_counter() - start)
+        vector.close()
+    return results
+
+
+def bench_autopilot(decisions=200, depth=3):
+    # nodes searched per second and how often the transposition table already had the answer,
+    # searching to a fixed depth so every run does the same work
+    from autopilot import Autopilot
+    autopilot = Autopilot(budget_ms=0, max_depth=depth)
+    random.seed(0)
+    game = Game(headless=True)
+    while autopilot.decisions < decisions and not game.done:
+        game.step(autopilot(game))
+    stats = autopilot.stats()
+    return {"nodes_per_sec": stats["nodes_per_sec"], "table_hit_rate": stats["table_hit_rate"]}
+
+
+def bench_capture(ticks=2000):
+    # microseconds per tick of a headless game drawn offscreen every tick, then with each frame looked at
+    # through a pixels3d view, and then saved as raw video and as PNGs by the background writer
+    import tempfile
+    from capture import FrameWriter, capture_game
+    screen, offscreen = Main.screen, Main.offscreen
+    capture_game(ticks)  # loads the fonts and sprites
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for name in ("offscreen", "view", "raw", "png"):
+            writer = None
+            consumer = None
+            if name == "view":
+                consumer = lambda pixels: pixels[0, 0]
+            elif name != "offscreen":
+                writer = FrameWriter(os.path.join(path, name), Game(headless=True).window_size, name, policy="block")
+                consumer = writer.write
+            frames, elapsed = capture_game(ticks, consumer=consumer)
+            if writer is not None:
+                writer.close()
+            results[name] = elapsed / frames * 1e6
+    Main.screen, Main.offscreen = screen, offscreen
+    return results
+
+
+def bench_sound(requests=20000):
+    # microseconds per sound asked for, played straight on the mixer the way the game used to and through
+    # the sound manager, for a game running much faster than real time: a chomp every request and the
+    # other sounds now and then (the dummy audio driver still mixes, it just doesn't output anything)
+    names = ["chomp"] * requests
+    for i in range(0, requests, 10):
+        names[i] = "eatfruit" if i % 30 else "eatghost"
+    for i in range(0, requests, 200):
+        names[i] = "death"
+    manager = Main.SoundManager()
+    manager.play("chomp")  # starts the mixer
+    for name in set(names):
+        Main.assets.sound(name)
+    results = {}
+    for label, play in (("direct", lambda name: Main.assets.sound(name).play()), ("managed", manager.play)):
+        start = time.perf_counter()
+        for name in names:
+            play(name)
+        results[label] = (time.perf_counter() - start) / requests * 1e6
+        pygame.mixer.stop()
+    return results
+
+
+def bench_results(rows=100000):
+    # episodes saved to the results store per second by one writer, then the milliseconds for the
+    # best 10 scores and the per policy summary (python results.py bench does this with millions of rows)
+    import tempfile
+    from results import ResultsStore, insert_fake_episodes, timed_query
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, "results.sqlite")
+        start = time.perf_counter()
+        insert_fake_episodes(path, rows, 0, 10000)
+        results = {"insert": rows / (time.perf_counter() - start)}
+        store = ResultsStore(path)
+        results["top10"] = timed_query(lambda: store.top_scores(10))
+        results["summary"] = timed_query(store.policy_summary)
+        store.close()
+    return results
+
+
+STARTUP_CODE = """
+import time
+start = time.perf_counter()
+import Main
+imported = time.perf_counter()
+game = Main.Game()
+game.draw()
+for character in game.charList:
+    character.draw()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def bench_startup(runs=3):
+    # milliseconds to import Main, and then to create a game and draw its first frame with every sprite,
+    # each run is a fresh process, the best run is kept
+    imports, first_frames = [], []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_CODE], capture_output=True, text=True,
+                                env=dict(os.environ, PACMAN_HEADLESS="1")).stdout
+        import_time, first_frame = output.split()[-2:]
+        imports.append(float(import_time) * 1e3)
+        first_frames.append(float(first_frame) * 1e3)
+    return {"import": min(imports), "first_frame": min(first_frames)}
+
+
+def collect():
+    # runs every benchmark, each result is saved with its unit and whether a bigger number is better,
+    # results that aren't timings (like how many ticks it took to clear a level) are saved but never compared
+    results = {}
+
+    def add(name, value, unit, higher_is_better=None):
+        results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        print("%-32s %12.2f %s" % (name, value, unit), flush=True)
+
+    for name, startup_time in bench_startup().items():
+        add("startup." + name, startup_time, "ms", False)
+    for name, frame_time in bench_render().items():
+        add("render." + name, frame_time, "us/frame", False)
+    add("headless", bench_headless(), "ticks/s", True)
+    for name, rate in bench_telemetry().items():
+        add("telemetry." + name, rate, "ticks/s", True)
+    for n, rate in bench_batch().items():
+        add("batch.n%d" % n, rate, "game-ticks/s", True)
+    for name, rate in bench_clone().items():
+        add("state." + name, rate, "/s", True)
+    for name, rate in bench_ghost_types().items():
+        add("choose_direction." + name, rate, "decisions/s", True)
+    for (mode, count), decision_time in bench_ghost_decisions().items():
+        add("ghosts.%s.%d" % (mode, count), decision_time, "us/decision", False)
+    units = {"compile": ("ms", False), "load": ("ms", False), "ticks": ("ticks/s", True),
+             "aware_ticks": ("ticks/s", True), "frame": ("us/frame", False)}
+    for (size, name), value in bench_mazes().items():
+        add("maze%d.%s" % (size, name), value, *units[name])
+    for (count, name), value in bench_swarm().items():
+        add("swarm%d.%s" % (count, name), value, "us/" + name, False)
+    for name, value in bench_env().items():
+        if name.startswith("vector"):
+            add("env." + name, value, "steps/s", True)
+        else:
+            add("env." + name, value, "us/step", False)
+    for name, frame_time in bench_capture().items():
+        add("capture." + name, frame_time, "us/frame", False)
+    for name, request_time in bench_sound().items():
+        add("sound." + name, request_time, "us/request", False)
+    stored = bench_results()
+    add("results.insert", stored["insert"], "rows/s", True)
+    add("results.top10", stored["top10"], "ms", False)
+    add("results.summary", stored["summary"], "ms", False)
+    autopilot = bench_autopilot()
+    add("autopilot.nodes", autopilot["nodes_per_sec"], "nodes/s", True)
+    add("autopilot.table_hit_rate", autopilot["table_hit_rate"], "hits/lookup")
+    level = bench_level()
+    add("level.time", level["time"], "ms", False)
+    add("level.ticks", level["ticks"], "ticks")
+    add("level.lives_lost", level["lives_lost"], "lives")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # names of the results that are more than tolerance (a fraction) worse than in the baseline
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or result["higher_is_better"] is None or not old["value"]:
+            continue
+        change = (result["value"] - old["value"]) / old["value"]
+        if result["higher_is_better"]:
+            change = -change
+        if change > tolerance:
+            regressions.append(name)
+            print("REGRESSION %-32s %12.2f -> %.2f %s (%+.0f%%)"
+                  % (name, old["value"], result["value"], result["unit"], change * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the Pacman game")
+    parser.add_argument("--out", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="how much worse a result can get (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = collect()
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"python": sys.version.split()[0], "pygame": pygame.version.ver,
+                       "machine": platform.platform(), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        print("%d regressions against %s" % (len(regressions), args.baseline))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# Captures the frames of a game as numpy arrays and saves them as PNG files or raw video
+# run with: python capture.py --ticks 3600 --out frames --format png   (plays a headless game and saves every frame)
+#           python capture.py --measure                               (how much capturing slows a headless game down)
+# the game is drawn into a surface in memory (see Main.open_offscreen) and each frame is handed out as a
+# pixels3d view of that surface, nothing is copied unless whoever gets the frame copies it
+# raw video is one file of rgb24 frames one after the other, video.json has what's needed to read it back, e.g.
+#   ffmpeg -f rawvideo -pix_fmt rgb24 -s WIDTHxHEIGHT -r 60 -i frames.rgb out.mp4
+# PNGs are encoded here with zlib instead of pygame.image.save, zlib lets go of the GIL while it compresses
+# so the writer thread hardly slows the game down, pygame's encoder holds it the whole time
+import argparse
+import json
+import os
+import queue
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import headless  # before Main, so no window or sound card is opened
+import pygame
+import Main
+from Main import Game, TICK_RATE
+
+RAW_FILE = "frames.rgb"
+RAW_INFO = "video.json"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(rows, width, height, level=1):
+    # rows is the image as PNG stores it before compressing: every row starts with a filter byte (0, no filter)
+    # followed by the row's rgb pixels
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)  # 8 bit rgb
+    return (PNG_SIGNATURE + png_chunk(b"IHDR", header) + png_chunk(b"IDAT", zlib.compress(rows, level))
+            + png_chunk(b"IEND", b""))
+
+
+class FrameCapture:
+    # draws a game offscreen and passes each frame to a consumer, the frame is a (height, width, 3) view of
+    # the surface the game is drawn on, it's only valid during the call since the surface is locked while a
+    # view of it exists and the next frame couldn't be drawn
+    def __init__(self, game):
+        self.game = game
+        Main.open_offscreen(game.window_size)
+        game.maze_layer = None  # the first frame draws the whole maze onto the new surface
+        self.frames = 0
+
+    def render(self, consumer=None):
+        self.game.draw()
+        self.frames += 1
+        if consumer is not None:
+            pixels = pygame.surfarray.pixels3d(Main.screen)
+            consumer(pixels.transpose(1, 0, 2))
+            del pixels  # unlocks the surface
+
+    def array(self):
+        # a copy of the last frame that can be kept
+        return pygame.surfarray.array3d(Main.screen).transpose(1, 0, 2).copy()
+
+
+class FrameWriter:
+    # saves frames from a background thread, each frame is copied into one of max_pending buffers and
+    # queued for the writer, when all of them are waiting to be written policy decides what happens:
+    # "drop" skips the frame (and counts it) and "block" waits for the writer to free a buffer
+    # png_level is the zlib compression level, 1 is the fastest
+    def __init__(self, path, size, format="png", max_pending=8, policy="drop", png_level=1):
+        if format not in ("png", "raw"):
+            raise ValueError("format has to be png or raw")
+        if policy not in ("drop", "block"):
+            raise ValueError("policy has to be drop or block")
+        self.path = path
+        self.size = size
+        self.format = format
+        self.policy = policy
+        self.png_level = png_level
+        os.makedirs(path, exist_ok=True)
+        width, height = size
+        # a buffer and the (height, width, 3) view of it frames are copied into, PNG buffers have the filter
+        # byte in front of each row so they can be compressed as they are
+        self.free = queue.Queue()
+        for i in range(max_pending):
+            if format == "png":
+                buffer = np.zeros((height, 1 + width * 3), np.uint8)
+                self.free.put((buffer, buffer[:, 1:].reshape(height, width, 3)))
+            else:
+                buffer = np.empty((height, width, 3), np.uint8)
+                self.free.put((buffer, buffer))
+        self.pending = queue.Queue()
+        self.raw = open(os.path.join(path, RAW_FILE), "wb") if format == "raw" else None
+        self.frames = 0  # frames queued to be written
+        self.written = 0
+        self.dropped = 0
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
+
+    def write(self, pixels):
+        # pixels is a (height, width, 3) array such as the frames FrameCapture gives out,
+        # returns whether the frame was kept
+        try:
+            buffer, view = self.free.get(block=self.policy == "block")
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        np.copyto(view, pixels)
+        self.pending.put((self.frames, buffer, view))
+        self.frames += 1
+        return True
+
+    def write_frames(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            number, buffer, view = item
+            if self.raw is not None:
+                self.raw.write(buffer)
+            else:
+                with open(os.path.join(self.path, "frame_%06d.png" % number), "wb") as f:
+                    f.write(encode_png(buffer, self.size[0], self.size[1], self.png_level))
+            self.written += 1
+            self.free.put((buffer, view))
+
+    def close(self, fps=TICK_RATE):
+        # waits for every queued frame to be written
+        self.pending.put(None)
+        self.writer.join()
+        if self.raw is not None:
+            self.raw.close()
+            with open(os.path.join(self.path, RAW_INFO), "w") as f:
+                json.dump({"width": self.size[0], "height": self.size[1], "pix_fmt": "rgb24", "fps": fps,
+                           "frames": self.written}, f)
+
+
+def read_raw_video(path):
+    # the frames of a raw video as a (frames, height, width, 3) memory mapped array
+    with open(os.path.join(path, RAW_INFO)) as f:
+        info = json.load(f)
+    return np.memmap(os.path.join(path, RAW_FILE), np.uint8, mode="r",
+                     shape=(info["frames"], info["height"], info["width"], 3))
+
+
+def capture_game(ticks, seed=0, every=1, consumer=None):
+    # plays a headless game steered at random for the given number of ticks, drawing every `every`th tick,
+    # returns the frames drawn and the time it took
+    from runner import random_turns
+    random.seed(seed)
+    rng = random.Random(seed)
+    game = Game(headless=True)
+    capture = FrameCapture(game)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        if game.step(random_turns(game, rng)):
+            game = Game(headless=True)
+            capture = FrameCapture(game)
+        if tick % every == 0:
+            capture.render(consumer)
+    return ticks // every + (ticks % every > 0), time.perf_counter() - start
+
+
+def measure(ticks, path, max_pending, policy):
+    # runs the same game with more of the capture pipeline each time, what each step adds per frame is its overhead
+    # the game is captured once first so loading the fonts and sprites isn't counted in the first run that draws
+    capture_game(ticks)
+    runs = [("simulation only", None, None), ("drawn offscreen", None, None),
+            ("drawn + pixels3d view", lambda pixels: pixels[0, 0], None),
+            ("drawn + raw video", None, "raw"), ("drawn + png", None, "png")]
+    print("%-24s %12s %12s %14s %8s" % ("", "ticks/sec", "x real time", "added ms/frame", "dropped"))
+    base = None
+    for name, consumer, format in runs:
+        writer = None
+        if format is not None:
+            writer = FrameWriter(os.path.join(path, format), Game().window_size, format, max_pending, policy)
+            consumer = writer.write
+        if name == "simulation only":
+            from runner import random_turns
+            random.seed(0)
+            rng = random.Random(0)
+            game = Game(headless=True)
+            start = time.perf_counter()
+            for tick in range(ticks):
+                if game.step(random_turns(game, rng)):
+                    game = Game(headless=True)
+            elapsed = time.perf_counter() - start
+        else:
+            frames, elapsed = capture_game(ticks, consumer=consumer)
+        dropped = 0
+        if writer is not None:
+            writer.close()
+            dropped = writer.dropped
+        per_frame = elapsed / ticks * 1000
+        if base is None:
+            base = per_frame
+        print("%-24s %12.0f %12.1f %14.3f %8d" % (name, ticks / elapsed, ticks / elapsed / TICK_RATE,
+                                                  per_frame - base, dropped), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Captures the frames of a headless game of Pacman")
+    parser.add_argument("--ticks", type=int, default=3600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--every", type=int, default=1, help="capture every nth tick")
+    parser.add_argument("--out", default=None, help="directory to save to (frames, or a temporary one with --measure)")
+    parser.add_argument("--format", choices=("png", "raw"), default="png")
+    parser.add_argument("--policy", choices=("drop", "block"), default="block",
+                        help="what happens to a frame when the writer has fallen behind")
+    parser.add_argument("--max-pending", type=int, default=8, help="frames that can wait to be written")
+    parser.add_argument("--measure", action="store_true", help="time each part of capturing instead")
+    args = parser.parse_args()
+
+    if args.measure:
+        if args.out is not None:
+            measure(args.ticks, args.out, args.max_pending, args.policy)
+        else:
+            with tempfile.TemporaryDirectory() as path:
+                measure(args.ticks, path, args.max_pending, args.policy)
+        return
+    args.out = args.out or "frames"
+    writer = FrameWriter(args.out, Game().window_size, args.format, args.max_pending, args.policy)
+    frames, elapsed = capture_game(args.ticks, args.seed, args.every, writer.write)
+    writer.close(TICK_RATE / args.every)
+    print("captured %d frames in %.2fs (%.0f frames/sec), %d written, %d dropped, to %s"
+          % (frames, elapsed, frames / elapsed, writer.written, writer.dropped, args.out))
+
+
+if __name__ == "__main__":
+    main()
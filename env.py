@@ -0,0 +1,281 @@
+# A reinforcement learning environment around Game, in the style of Gymnasium's Env and VectorEnv
+# an observation is a stack of one layer per kind of thing in the maze (see CHANNELS), one byte per tile
+# (two with 256 ghosts or more so a tile's ghost count can't wrap around), it is kept up to date in place
+# so only the tiles that changed are written each step
+import multiprocessing
+import os
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import headless  # before Main, so no window or sound card is opened
+from Main import Game, Maze, Pacman, UP, DOWN, LEFT, RIGHT, SCATTER, CHASE, SCARED, EATEN
+
+# actions are indexes into this tuple, None keeps pacman going the way he is
+ACTIONS = (UP, DOWN, LEFT, RIGHT, None)
+# the layers of an observation, a ghost layer counts how many ghosts in that state are on each tile
+CHANNELS = ("walls", "dots", "energizers", "scatter", "chase", "scared", "eaten", "pacman", "cherry")
+WALLS, DOTS, ENERGIZERS = range(3)
+GHOST_CHANNELS = {SCATTER: 3, CHASE: 4, SCARED: 5, EATEN: 6}
+PACMAN, CHERRY = 7, 8
+# what info() reports about the game, a VectorEnv gives an array of each
+INFO_KEYS = ("score", "level", "lives", "ticks")
+
+
+def observation_shape(maze_file=None):
+    maze = Maze(maze_file)
+    maze.load_map()
+    return (len(CHANNELS), maze.height, maze.width)
+
+
+def observation_dtype(num_ghosts=4):
+    # every ghost could be on the same tile, the count has to fit
+    return np.uint8 if num_ghosts < 256 else np.uint16
+
+
+class Discrete:
+    # the actions an environment takes, 0 to n - 1, with the same attributes as gymnasium.spaces.Discrete
+    def __init__(self, n):
+        self.n = n
+        self.shape = ()
+        self.dtype = np.dtype(np.int64)
+
+    def sample(self, rng=None):
+        return int((rng or np.random.default_rng()).integers(self.n))
+
+    def contains(self, x):
+        return 0 <= int(x) < self.n
+
+
+class MultiDiscrete:
+    # an action for each environment of a VectorEnv, like gymnasium.spaces.MultiDiscrete
+    def __init__(self, nvec):
+        self.nvec = np.asarray(nvec, np.int64)
+        self.shape = self.nvec.shape
+        self.dtype = np.dtype(np.int64)
+
+    def sample(self, rng=None):
+        return (rng or np.random.default_rng()).integers(self.nvec)
+
+    def contains(self, x):
+        x = np.asarray(x)
+        return x.shape == self.shape and bool(np.all((0 <= x) & (x < self.nvec)))
+
+
+class Box:
+    # arrays of a fixed shape and type with every value between low and high, like gymnasium.spaces.Box
+    def __init__(self, low, high, shape, dtype):
+        self.low = low
+        self.high = high
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def sample(self, rng=None):
+        return (rng or np.random.default_rng()).integers(self.low, self.high, self.shape, self.dtype, endpoint=True)
+
+    def contains(self, x):
+        x = np.asarray(x)
+        return x.shape == self.shape and bool(np.all((self.low <= x) & (x <= self.high)))
+
+
+class PacmanEnv:
+    # one step is ticks_per_step ticks of the game (one move of pacman by default) with the same action held,
+    # the reward is the score gained, an episode is truncated after max_ticks
+    # observation can be given to have the observations written into an existing array (see VectorEnv)
+    def __init__(self, ticks_per_step=Pacman.move_rate, max_ticks=100000, observation=None, **game_options):
+        self.ticks_per_step = ticks_per_step
+        self.max_ticks = max_ticks
+        self.game_options = game_options
+        self.observation_shape = observation_shape(game_options.get("maze_file"))
+        num_ghosts = game_options.get("num_ghosts", 4)
+        self.action_space = Discrete(len(ACTIONS))
+        self.observation_space = Box(0, max(num_ghosts, 1), self.observation_shape, observation_dtype(num_ghosts))
+        if observation is None:
+            observation = np.zeros(self.observation_shape, self.observation_space.dtype)
+        self.observation = observation
+        self.flat = observation.reshape(-1)  # the same memory, indexed by channel * tiles + tile
+        self.tiles = self.observation_shape[1] * self.observation_shape[2]
+        self.game = None
+
+    def reset(self, seed=None, options=None):
+        # starts a new game, the random module is seeded like runner.py does so a seed always plays out the same
+        # the start screen is skipped since nothing can be done during it
+        if seed is not None:
+            random.seed(seed)
+        self.game = Game(headless=True, **self.game_options)
+        while self.game.display_start_screen:
+            self.game.step()
+        self.write_observation()
+        return self.observation, self.info()
+
+    def step(self, action):
+        game = self.game
+        score = game.score
+        direction = ACTIONS[action]
+        for tick in range(self.ticks_per_step):
+            if game.step(direction):
+                break
+        self.update_observation()
+        return self.observation, game.score - score, game.done, game.ticks >= self.max_ticks, self.info()
+
+    def info(self):
+        # the same keys as INFO_KEYS
+        return {"score": self.game.score, "level": self.game.level, "lives": self.game.pac.lives,
+                "ticks": self.game.ticks}
+
+    def write_observation(self):
+        # the whole observation, only done at the start of a game
+        maze = self.game.maze
+        self.observation.fill(0)
+        self.flat[WALLS * self.tiles:(WALLS + 1) * self.tiles] = np.frombuffer(bytes(maze.walkable), np.uint8) ^ 1
+        self.pellets = 0
+        self.update_pellets()
+        self.characters = []  # flat indexes of the character and cherry tiles written last step
+        self.update_characters()
+
+    def update_observation(self):
+        self.update_pellets()
+        self.update_characters()
+
+    def update_pellets(self):
+        # only the tiles whose edible has been eaten (or put back for a new level) since the last step
+        maze = self.game.maze
+        changed = self.pellets ^ maze.pellets
+        while changed:
+            bit = changed & -changed
+            tile = bit.bit_length() - 1
+            channel = DOTS if maze.layout[tile // maze.width][tile % maze.width] == "*" else ENERGIZERS
+            self.flat[channel * self.tiles + tile] = 1 if maze.pellets & bit else 0
+            changed ^= bit
+        self.pellets = maze.pellets
+
+    def update_characters(self):
+        # rubs out where the characters were and marks where they are now
+        flat = self.flat
+        for index in self.characters:
+            flat[index] -= 1
+        game = self.game
+        width = game.maze.width
+        characters = [GHOST_CHANNELS[ghost.state] * self.tiles + ghost.y * width + ghost.x
+                      for ghost in game.charList[:-1]]
+        characters.append(PACMAN * self.tiles + game.pac.y * width + game.pac.x)
+        if game.cherry_visible():
+            characters.append(CHERRY * self.tiles + game.cherry.y * width + game.cherry.x)
+        for index in characters:
+            flat[index] += 1
+        self.characters = characters
+
+
+def shared_layout(n, shape, dtype):
+    # the arrays the vector environment shares with its workers, laid out one after the other,
+    # the 8 byte ones go first so they stay aligned
+    return (("rewards", np.int64, (n,)), ("actions", np.int64, (n,)), ("infos", np.int64, (len(INFO_KEYS), n)),
+            ("observations", dtype, (n,) + shape), ("terminated", np.bool_, (n,)), ("truncated", np.bool_, (n,)))
+
+
+def shared_size(n, shape, dtype):
+    return sum(np.dtype(array_dtype).itemsize * int(np.prod(array_shape)) for name, array_dtype, array_shape
+               in shared_layout(n, shape, dtype))
+
+
+def shared_arrays(buffer, n, shape, dtype):
+    arrays = {}
+    offset = 0
+    for name, dtype, array_shape in shared_layout(n, shape, dtype):
+        arrays[name] = np.ndarray(array_shape, dtype, buffer, offset)
+        offset += arrays[name].nbytes
+    return arrays
+
+
+def run_worker(connection, memory_name, n, shape, dtype, start, stop, env_options):
+    # steps environments start to stop of a VectorEnv, writing straight into the shared arrays
+    memory = shared_memory.SharedMemory(name=memory_name)
+    arrays = shared_arrays(memory.buf, n, shape, dtype)
+    infos = arrays["infos"]
+    envs = [PacmanEnv(observation=arrays["observations"][i], **env_options) for i in range(start, stop)]
+    while True:
+        command, data = connection.recv()
+        if command == "reset":
+            for i, (env, seed) in enumerate(zip(envs, data), start):
+                observation, info = env.reset(seed)
+                infos[:, i] = [info[key] for key in INFO_KEYS]
+        elif command == "step":
+            for i, env in enumerate(envs, start):
+                observation, reward, terminated, truncated, info = env.step(arrays["actions"][i])
+                arrays["rewards"][i] = reward
+                arrays["terminated"][i] = terminated
+                arrays["truncated"][i] = truncated
+                infos[:, i] = [info[key] for key in INFO_KEYS]
+                if terminated or truncated:
+                    env.reset()  # the next game carries on from the random module's state
+        else:
+            break
+        connection.send(None)
+    del arrays, infos, envs  # the views have to go before the memory can be closed
+    memory.close()
+
+
+class VectorEnv:
+    # n environments stepped together by a pool of worker processes, every step waits for all of them
+    # the observations, rewards and flags live in shared memory so only a short message goes through each pipe,
+    # an environment whose game ends is reset straight away and its next observation is from the new game,
+    # its reward, flags and infos for that step are still the ones of the game that ended
+    # step returns the arrays themselves, which the next step writes over
+    def __init__(self, n, workers=None, **env_options):
+        self.n = n
+        self.shape = observation_shape(env_options.get("maze_file"))
+        num_ghosts = env_options.get("num_ghosts", 4)
+        dtype = observation_dtype(num_ghosts)
+        self.single_action_space = Discrete(len(ACTIONS))
+        self.single_observation_space = Box(0, max(num_ghosts, 1), self.shape, dtype)
+        self.action_space = MultiDiscrete([len(ACTIONS)] * n)
+        self.observation_space = Box(0, max(num_ghosts, 1), (n,) + self.shape, dtype)
+        workers = min(n, workers or os.cpu_count() or 1)
+        self.memory = shared_memory.SharedMemory(create=True, size=shared_size(n, self.shape, dtype))
+        arrays = shared_arrays(self.memory.buf, n, self.shape, dtype)
+        self.observations = arrays["observations"]
+        self.rewards = arrays["rewards"]
+        self.actions = arrays["actions"]
+        self.terminated = arrays["terminated"]
+        self.truncated = arrays["truncated"]
+        self.infos = {key: arrays["infos"][i] for i, key in enumerate(INFO_KEYS)}  # key -> a value per environment
+        self.connections = []
+        self.processes = []
+        self.slices = []
+        for worker in range(workers):
+            start, stop = n * worker // workers, n * (worker + 1) // workers
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker, daemon=True,
+                                              args=(child, self.memory.name, n, self.shape, dtype, start, stop,
+                                                    env_options))
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+            self.slices.append((start, stop))
+
+    def send(self, command, data=None):
+        for connection, (start, stop) in zip(self.connections, self.slices):
+            connection.send((command, data[start:stop] if data is not None else None))
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self, seed=None):
+        # environment i is seeded with seed + i
+        seeds = [None] * self.n if seed is None else [seed + i for i in range(self.n)]
+        self.send("reset", seeds)
+        return self.observations, self.infos
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self.send("step")
+        return self.observations, self.rewards, self.terminated, self.truncated, self.infos
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.observations = self.rewards = self.actions = self.terminated = self.truncated = self.infos = None
+        self.memory.close()
+        self.memory.unlink()
@@ -0,0 +1,5 @@
+# Makes Main start as a simulation without a window or a sound card (see Main.HEADLESS), the tools that only
+# run games (runner.py, env.py, server.py, capture.py, benchmark.py) import it before they import Main
+import os
+
+os.environ.setdefault("PACMAN_HEADLESS", "1")
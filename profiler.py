@@ -0,0 +1,177 @@
+# Finds out where the time goes in a game of Pacman
+# run with: python profiler.py --instrument [--overlay] [--out summary.json]   (times each phase of Game.play)
+#           python profiler.py --profile [--ticks 100000] [--out game.pstats]  (cProfiles a headless game)
+import argparse
+import atexit
+import cProfile
+import csv
+import json
+from array import array
+from time import perf_counter_ns
+
+import pygame
+import Main
+from Main import Game, Pacman, Blinky, Pinky, Inky, Clyde, WHITE, BLACK
+
+
+class Timings:
+    # the last `size` samples of one phase in nanoseconds, kept in a ring so percentiles follow recent frames
+    def __init__(self, size):
+        self.samples = array("q", [0] * size)
+        self.count = 0
+        self.total = 0
+
+    def add(self, elapsed):
+        self.samples[self.count % len(self.samples)] = elapsed
+        self.count += 1
+        self.total += elapsed
+
+    def percentiles(self, *points):
+        recent = sorted(self.samples[:min(self.count, len(self.samples))])
+        if not recent:
+            return [0] * len(points)
+        return [recent[min(len(recent) - 1, int(len(recent) * point / 100))] for point in points]
+
+
+class Profiler:
+    # wraps the methods that make up Game.play with timers, everything is put back by uninstrument
+    def __init__(self, window=1000, overlay=False):
+        self.window = window
+        self.overlay = overlay
+        self.timings = {}
+        self.patched = []  # (owner, attribute name, original value or None if it was inherited)
+        self.overlay_surface = None
+        self.frames = 0
+
+    def add(self, name, elapsed):
+        timings = self.timings.get(name)
+        if timings is None:
+            timings = self.timings[name] = Timings(self.window)
+        timings.add(elapsed)
+
+    def wrap(self, owner, attribute, name):
+        original = getattr(owner, attribute)
+        add = self.add
+
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            result = original(*args, **kwargs)
+            add(name, perf_counter_ns() - start)
+            return result
+        self.patched.append((owner, attribute, owner.__dict__.get(attribute) if isinstance(owner, type)
+                             else original))
+        setattr(owner, attribute, timed)
+
+    def instrument(self):
+        self.wrap(Pacman, "set_key", "set_key")
+        self.wrap(Game, "update", "update")
+        self.wrap(Game, "draw_game", "draw_game")
+        self.wrap(Game, "game_text", "game_text")
+        for cls in (Blinky, Pinky, Inky, Clyde, Pacman):
+            for method in ("choose_state", "move", "draw"):
+                self.wrap(cls, method, cls.__name__ + "." + method)
+        self.wrap(Pacman, "check_intersect", "Pacman.check_intersect")
+        self.wrap(pygame.event, "get", "event_pump")
+        self.wrap(pygame.display, "update", "flip")
+        # the whole frame is timed last so the overlay can be added on top of it
+        self.wrap(Game, "draw", "draw")
+        if self.overlay:
+            draw = Game.draw
+
+            def draw_with_overlay(game):
+                return draw(game) + [self.draw_overlay()]
+            self.patched.append((Game, "draw", Game.__dict__["draw"]))
+            Game.draw = draw_with_overlay
+
+    def uninstrument(self):
+        for owner, attribute, original in reversed(self.patched):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        self.patched = []
+
+    def draw_overlay(self):
+        # the slowest phases in the corner of the screen, the text is only rendered again every 30 frames
+        if self.frames % 30 == 0:
+            font = Main.assets.font(*Game.font)
+            lines = ["%-24s %7s %7s %7s" % ("phase (us)", "p50", "p95", "p99")]
+            slowest = sorted(self.timings.items(), key=lambda item: -item[1].percentiles(50)[0])[:8]
+            for name, timings in slowest:
+                lines.append("%-24s %7.0f %7.0f %7.0f" % ((name,) + tuple(p / 1000 for p in
+                                                                            timings.percentiles(50, 95, 99))))
+            rendered = [font.render(line, True, WHITE) for line in lines]
+            self.overlay_surface = pygame.Surface((max(r.get_width() for r in rendered),
+                                                   sum(r.get_height() for r in rendered)))
+            self.overlay_surface.fill(BLACK)
+            y = 0
+            for r in rendered:
+                self.overlay_surface.blit(r, (0, y))
+                y += r.get_height()
+        self.frames += 1
+        return Main.screen.blit(self.overlay_surface, (0, Main.screen.get_height() - self.overlay_surface.get_height()))
+
+    def summary(self):
+        # count, total and rolling percentiles of every phase, times in microseconds
+        result = {}
+        for name, timings in sorted(self.timings.items()):
+            p50, p95, p99 = timings.percentiles(50, 95, 99)
+            result[name] = {"count": timings.count, "total_us": timings.total / 1000,
+                            "p50_us": p50 / 1000, "p95_us": p95 / 1000, "p99_us": p99 / 1000}
+        return result
+
+    def save(self, path):
+        # written as CSV if the file name ends in .csv, otherwise as JSON
+        summary = self.summary()
+        with open(path, "w", newline="") as f:
+            if path.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["phase", "count", "total_us", "p50_us", "p95_us", "p99_us"])
+                for name, values in summary.items():
+                    writer.writerow([name] + list(values.values()))
+            else:
+                json.dump(summary, f, indent=2)
+
+
+def profile_headless(ticks, path):
+    # plays headless games for the given number of ticks under cProfile and saves the stats for pstats
+    from runner import random_turns
+    import random
+    rng = random.Random(0)
+    random.seed(0)
+    profile = cProfile.Profile()
+    profile.enable()
+    game = Game(headless=True)
+    for tick in range(ticks):
+        if game.step(random_turns(game, rng)):
+            game = Game(headless=True)
+    profile.disable()
+    profile.dump_stats(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the phases of a game of Pacman")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--instrument", action="store_true", help="time each phase of a game played in the window")
+    mode.add_argument("--profile", action="store_true", help="run a headless game under cProfile")
+    parser.add_argument("--overlay", action="store_true", help="show the timings on the screen")
+    parser.add_argument("--ticks", type=int, default=100000, help="ticks to run with --profile")
+    parser.add_argument("--out", help="where to save the summary (.json/.csv) or the pstats file")
+    args = parser.parse_args()
+
+    if args.profile:
+        out = args.out or "game.pstats"
+        profile_headless(args.ticks, out)
+        print("profile saved to %s, view it with: python -m pstats %s" % (out, out))
+        return
+
+    profiler = Profiler(overlay=args.overlay)
+    profiler.instrument()
+    out = args.out or "profile_summary.json"
+    atexit.register(profiler.save, out)
+    game = Game()
+    game.play()
+
+
+if __name__ == "__main__":
+    main()
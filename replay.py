@@ -0,0 +1,181 @@
+# Records the input of a game of Pacman and replays it headlessly at full speed
+# run with: python replay.py record game.pacrec   (plays the game in a window and saves the recording)
+#           python replay.py play game.pacrec     (replays it and checks it plays out the same)
+import os
+import random
+import struct
+import sys
+import time
+
+from Main import Game, UP, DOWN, LEFT, RIGHT
+
+MAGIC = b"PACREC"
+VERSION = 3
+# header: magic, version, flags, seed, ticks, number of runs, number of checkpoints, the game's death pause ticks,
+# number of ghosts, the hash of the maze's layout and the length of the maze file's path, followed by the path
+# (empty for the built in map)
+HEADER = struct.Struct("<6sBBQIIIIH20sH")
+RUN = struct.Struct("<BH")  # direction code and how many ticks in a row it was held for
+# checkpoint: tick, score, lives, level, then x and y of every character in charList order
+CHECKPOINT = "<IIBH%dH"  # sized for the number of characters with checkpoint_struct
+CHECKPOINT_INTERVAL = 600  # ticks between checkpoints
+MAZE_AWARE = 1  # flag for games with maze aware ghosts
+
+# pacman's input for a tick is stored as one of these codes, 0 means no key was pressed
+DIRECTION_CODES = {None: 0, UP: 1, DOWN: 2, LEFT: 3, RIGHT: 4}
+CODE_DIRECTIONS = {code: direction for direction, code in DIRECTION_CODES.items()}
+
+
+class ReplayMismatch(Exception):
+    pass
+
+
+def checkpoint_struct(num_ghosts):
+    return struct.Struct(CHECKPOINT % (2 * (num_ghosts + 1)))
+
+
+def checkpoint(game):
+    # the score, lives, level and positions of the characters at the current tick
+    positions = []
+    for character in game.charList:
+        positions += (character.x, character.y)
+    return (game.ticks, game.score, game.pac.lives, game.level) + tuple(positions)
+
+
+def game_options(game):
+    # the options the game was created with, everything besides the seed and the input that changes how it plays
+    return {"maze_aware_ghosts": game.maze_aware_ghosts, "death_pause_ticks": game.death_pause_ticks,
+            "num_ghosts": len(game.charList) - 1, "maze_file": game.maze.path}
+
+
+class Recording:
+    # options are the keyword arguments for Game that the game was recorded with (see game_options)
+    # and layout_hash is the maze's, so a maze file that has changed since is noticed
+    def __init__(self, seed, options, layout_hash):
+        self.seed = seed
+        self.options = options
+        self.layout_hash = layout_hash
+        self.ticks = 0
+        self.runs = []  # [direction code, ticks] pairs, a new one starts whenever the input changes
+        self.checkpoints = []
+
+    def save(self, path):
+        options = self.options
+        flags = MAZE_AWARE if options["maze_aware_ghosts"] else 0
+        maze_file = (options["maze_file"] or "").encode()
+        checkpoint_format = checkpoint_struct(options["num_ghosts"])
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, flags, self.seed, self.ticks, len(self.runs), len(self.checkpoints),
+                                options["death_pause_ticks"], options["num_ghosts"], self.layout_hash,
+                                len(maze_file)))
+            f.write(maze_file)
+            for code, count in self.runs:
+                f.write(RUN.pack(code, count))
+            for values in self.checkpoints:
+                f.write(checkpoint_format.pack(*values))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, flags, seed, ticks, num_runs, num_checkpoints, death_pause_ticks, num_ghosts, layout_hash, \
+            path_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a Pacman recording")
+        offset = HEADER.size
+        maze_file = data[offset:offset + path_length].decode() or None
+        offset += path_length
+        recording = cls(seed, {"maze_aware_ghosts": bool(flags & MAZE_AWARE), "death_pause_ticks": death_pause_ticks,
+                               "num_ghosts": num_ghosts, "maze_file": maze_file}, layout_hash)
+        recording.ticks = ticks
+        for i in range(num_runs):
+            recording.runs.append(list(RUN.unpack_from(data, offset)))
+            offset += RUN.size
+        checkpoint_format = checkpoint_struct(num_ghosts)
+        for i in range(num_checkpoints):
+            recording.checkpoints.append(checkpoint_format.unpack_from(data, offset))
+            offset += checkpoint_format.size
+        return recording
+
+    def directions(self):
+        # the input for every tick in order
+        for code, count in self.runs:
+            direction = CODE_DIRECTIONS[code]
+            for i in range(count):
+                yield direction
+
+
+class Recorder:
+    # attached to a game, it's called by Game.advance with the input of every tick before the tick runs
+    def __init__(self, game, seed):
+        self.recording = Recording(seed, game_options(game), game.maze.layout_hash)
+        self.game = game
+        game.recorder = self
+
+    def record(self, game):
+        recording = self.recording
+        if game.ticks % CHECKPOINT_INTERVAL == 0:
+            recording.checkpoints.append(checkpoint(game))
+        code = DIRECTION_CODES[game.pac.next_direction]
+        if recording.runs and recording.runs[-1][0] == code and recording.runs[-1][1] < 65535:
+            recording.runs[-1][1] += 1
+        else:
+            recording.runs.append([code, 1])
+        recording.ticks += 1
+
+    def save(self, path):
+        # the final state is saved as the last checkpoint
+        if not self.recording.checkpoints or self.recording.checkpoints[-1][0] != self.game.ticks:
+            self.recording.checkpoints.append(checkpoint(self.game))
+        self.recording.save(path)
+
+
+def new_game(seed, **options):
+    # the random module has to be seeded before the game is created since the cherry uses it straight away
+    random.seed(seed)
+    return Game(**options)
+
+
+def replay(recording):
+    # plays the recording headlessly as fast as possible, checking it against every checkpoint
+    # returns the game and the number of ticks a second it was replayed at
+    game = new_game(recording.seed, headless=True, **recording.options)
+    if game.maze.layout_hash != recording.layout_hash:
+        raise ReplayMismatch("the maze is not the one the game was recorded on")
+    checkpoints = {values[0]: values for values in recording.checkpoints}
+    start = time.perf_counter()
+    for direction in recording.directions():
+        while game.death_pause_left > 0:
+            game.advance()  # the pause after a death takes no input, so nothing was recorded for it
+        expected = checkpoints.get(game.ticks)
+        if expected is not None and checkpoint(game) != expected:
+            raise ReplayMismatch("tick %d: expected %s, got %s" % (game.ticks, expected, checkpoint(game)))
+        game.step(direction)
+    elapsed = time.perf_counter() - start
+    while game.death_pause_left > 0:
+        game.advance()
+    expected = checkpoints.get(game.ticks)
+    if expected is None or checkpoint(game) != expected:
+        raise ReplayMismatch("the replay finished at tick %d in a different state" % game.ticks)
+    return game, recording.ticks / max(elapsed, 1e-9)
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] not in ("record", "play"):
+        print("usage: python replay.py record|play FILE")
+        return
+    path = sys.argv[2]
+    if sys.argv[1] == "record":
+        seed = random.randrange(2 ** 32)
+        game = new_game(seed)
+        recorder = Recorder(game, seed)
+        game.play()
+        recorder.save(path)
+        print("recorded %d ticks to %s (%d bytes)" % (recorder.recording.ticks, path, os.path.getsize(path)))
+    else:
+        game, rate = replay(Recording.load(path))
+        print("replayed %d ticks at %.0f ticks/sec, score %d, level %d" % (game.ticks, rate, game.score, game.level))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+# Keeps the results of episodes and the game's high scores in a SQLite database
+# run with: python runner.py --episodes 1000 --db results.sqlite   (saves every episode the runner plays)
+#           python results.py top [-n 10] [--policy NAME]         (the best episodes)
+#           python results.py summary [--seed N]                  (totals for each policy, or for one seed)
+#           python results.py export episodes.csv                 (or .parquet, which needs pyarrow)
+#           python results.py bench --rows 10000000 --writers 4   (insert rate and query times)
+# the database is in WAL mode so reading never waits for writing, and rows are inserted batch_size at a time
+# in one transaction, so a writer only needs the database's write lock for a moment every batch_size rows
+# and many processes can write to it at once without waiting on each other much
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+DEFAULT_PATH = "results.sqlite"
+# with writers taking turns nonstop SQLite never gets a moment to start the write ahead log over, so it would
+# grow forever (to 24GB over 10 million rows with 4 writers), a writer that sees it's bigger than this waits
+# for the others and empties it
+WAL_LIMIT = 64 * 1024 * 1024
+# the columns of an episode, in the order they're inserted and exported
+COLUMNS = ("run", "policy", "seed", "score", "level", "ticks", "lives_lost", "ghosts_eaten", "cherries", "recorded")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    policy TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    ticks INTEGER NOT NULL,
+    lives_lost INTEGER NOT NULL,
+    ghosts_eaten INTEGER NOT NULL,
+    cherries INTEGER NOT NULL,
+    recorded REAL NOT NULL
+);
+-- for the best scores overall, the best for a policy and the episodes of a seed
+CREATE INDEX IF NOT EXISTS episodes_score ON episodes (score);
+CREATE INDEX IF NOT EXISTS episodes_policy_score ON episodes (policy, score);
+CREATE INDEX IF NOT EXISTS episodes_seed ON episodes (seed);
+-- running totals for each policy, added to in the same transaction as the episodes so they always agree,
+-- a policy's averages come from here instead of going through all of its episodes
+CREATE TABLE IF NOT EXISTS policy_totals (
+    policy TEXT PRIMARY KEY,
+    episodes INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    best_score INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    ticks INTEGER NOT NULL,
+    ghosts_eaten INTEGER NOT NULL,
+    cherries INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS high_scores (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS high_scores_score ON high_scores (score);
+"""
+INSERT_EPISODE = "INSERT INTO episodes (%s) VALUES (%s)" % (", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)))
+ADD_TOTALS = """
+INSERT INTO policy_totals VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (policy) DO UPDATE SET episodes = episodes + excluded.episodes, score = score + excluded.score,
+    best_score = max(best_score, excluded.best_score), level = level + excluded.level,
+    ticks = ticks + excluded.ticks, ghosts_eaten = ghosts_eaten + excluded.ghosts_eaten,
+    cherries = cherries + excluded.cherries
+"""
+
+
+class ResultsStore:
+    # add queues an episode and every batch_size of them are written together, close writes what's left
+    # a writer that finds another one committing waits up to timeout seconds for it
+    def __init__(self, path=DEFAULT_PATH, batch_size=10000, timeout=60):
+        self.path = path
+        self.batch_size = batch_size
+        # transactions are started and committed here rather than by the sqlite3 module
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        # an in-memory database (":memory:") can't be put in WAL mode, it says which mode it's in instead
+        self.wal = self.connection.execute("PRAGMA journal_mode=WAL").fetchone()[0] == "wal"
+        # in WAL mode this only loses the last transactions if the machine (not the process) goes down
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # rows go into the indexes in no particular order, so the more of them kept in memory the better (64MB)
+        self.connection.execute("PRAGMA cache_size=-65536")
+        self.connection.executescript(SCHEMA)
+        self.pending = []
+
+    def add(self, result, run="", policy=""):
+        # result is a dict like the ones runner.play_episode returns
+        self.pending.append((run, policy, result["seed"], result["score"], result["level"], result["ticks"],
+                             result.get("lives_lost", 0), result.get("ghosts_eaten", 0), result.get("cherries", 0),
+                             time.time()))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        totals = {}
+        for row in self.pending:
+            policy, score = row[1], row[3]
+            total = totals.get(policy)
+            if total is None:
+                totals[policy] = [policy, 1, score, score, row[4], row[5], row[7], row[8]]
+            else:
+                total[1] += 1
+                total[2] += score
+                total[3] = max(total[3], score)
+                total[4] += row[4]
+                total[5] += row[5]
+                total[6] += row[7]
+                total[7] += row[8]
+        # BEGIN IMMEDIATE takes the write lock straight away, so two writers can't both start and then
+        # have one of them fail when it goes to write
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany(INSERT_EPISODE, self.pending)
+            self.connection.executemany(ADD_TOTALS, totals.values())
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        self.pending = []
+        if self.wal and self.wal_size() > WAL_LIMIT:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def wal_size(self):
+        # 0 when there's no log file, which happens when the last connection to close has removed it
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except OSError:
+            return 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def top_scores(self, n=10, policy=None):
+        # (score, level, ticks, seed, policy, run) of the best n episodes, of every policy or just one
+        if policy is None:
+            return self.connection.execute("SELECT score, level, ticks, seed, policy, run FROM episodes "
+                                           "ORDER BY score DESC LIMIT ?", (n,)).fetchall()
+        return self.connection.execute("SELECT score, level, ticks, seed, policy, run FROM episodes WHERE policy = ? "
+                                       "ORDER BY score DESC LIMIT ?", (policy, n)).fetchall()
+
+    def policy_summary(self):
+        # (policy, episodes, average score, best score, average level, average ticks, ghosts eaten, cherries)
+        return self.connection.execute("SELECT policy, episodes, score * 1.0 / episodes, best_score, "
+                                       "level * 1.0 / episodes, ticks * 1.0 / episodes, ghosts_eaten, cherries "
+                                       "FROM policy_totals ORDER BY policy").fetchall()
+
+    def seed_summary(self, seed):
+        # (policy, episodes, average score, best score, average level, average ticks) for one seed
+        return self.connection.execute("SELECT policy, COUNT(*), AVG(score), MAX(score), AVG(level), AVG(ticks) "
+                                       "FROM episodes WHERE seed = ? GROUP BY policy", (seed,)).fetchall()
+
+    def add_high_score(self, score, level, name="player"):
+        self.connection.execute("INSERT INTO high_scores (name, score, level, recorded) VALUES (?, ?, ?, ?)",
+                                (name, score, level, time.time()))
+
+    def high_scores(self, n=10):
+        return self.connection.execute("SELECT name, score, level, recorded FROM high_scores ORDER BY score DESC "
+                                       "LIMIT ?", (n,)).fetchall()
+
+    def best_score(self):
+        return self.connection.execute("SELECT COALESCE(MAX(score), 0) FROM high_scores").fetchone()[0]
+
+    def episodes(self, chunk_rows=100000):
+        # every episode in the order they were added, chunk_rows at a time so the table is never all in memory
+        cursor = self.connection.execute("SELECT %s FROM episodes ORDER BY id" % ", ".join(COLUMNS))
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+    def export(self, path, chunk_rows=100000):
+        # writes every episode to a CSV file, or a Parquet file if the name ends in .parquet,
+        # one chunk at a time (a Parquet row group per chunk), returns the number of rows written
+        rows_written = 0
+        if path.endswith(".parquet"):
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("exporting to Parquet needs pyarrow (pip install pyarrow)")
+            types = {"run": pyarrow.string(), "policy": pyarrow.string(), "recorded": pyarrow.float64()}
+            schema = pyarrow.schema([(name, types.get(name, pyarrow.int64())) for name in COLUMNS])
+            with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+                for rows in self.episodes(chunk_rows):
+                    columns = list(zip(*rows))
+                    writer.write_table(pyarrow.Table.from_arrays(
+                        [pyarrow.array(column, schema.field(i).type) for i, column in enumerate(columns)],
+                        schema=schema))
+                    rows_written += len(rows)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS)
+                for rows in self.episodes(chunk_rows):
+                    writer.writerows(rows)
+                    rows_written += len(rows)
+        return rows_written
+
+
+def insert_fake_episodes(path, rows, seed, batch_size):
+    # made up episodes for the benchmark, spread over a few policies and a million seeds
+    rng = random.Random(seed)
+    policies = ["random_turns", "keep_going", "autopilot:policy", "pellet_seeker"]
+    store = ResultsStore(path, batch_size)
+    for i in range(rows):
+        level = 1 + int(rng.expovariate(1.5))
+        store.add({"seed": rng.randrange(1000000), "score": level * 2500 + rng.randrange(2500), "level": level,
+                   "ticks": rng.randrange(500, 20000), "lives_lost": 3, "ghosts_eaten": rng.randrange(8),
+                   "cherries": rng.randrange(level + 1)}, "bench", rng.choice(policies))
+    store.close()
+
+
+def timed_query(query, repeats=20):
+    # the median time in milliseconds
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        query()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def bench(path, rows, writers, batch_size):
+    # rows episodes written by writers processes at once, then how long the common queries take
+    start = time.perf_counter()
+    ResultsStore(path).close()  # the schema is made once up front so the writers don't all try to
+    processes = [multiprocessing.Process(target=insert_fake_episodes,
+                                         args=(path, rows * (i + 1) // writers - rows * i // writers, i, batch_size))
+                 for i in range(writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    print("inserted %d rows with %d writers in %.1fs: %.0f rows/sec" % (rows, writers, elapsed, rows / elapsed))
+
+    store = ResultsStore(path)
+    store.add_high_score(12345, 5)
+    connection = store.connection
+    seeds = iter(random.Random(0).sample(range(1000000), 1000))
+    queries = [
+        ("top 10 scores", lambda: store.top_scores(10)),
+        ("top 10 for a policy", lambda: store.top_scores(10, "keep_going")),
+        ("policy summary", store.policy_summary),
+        ("policy summary (from episodes)", lambda: connection.execute(
+            "SELECT policy, COUNT(*), AVG(score), MAX(score), AVG(level), AVG(ticks), SUM(ghosts_eaten), "
+            "SUM(cherries) FROM episodes GROUP BY policy").fetchall()),
+        ("seed summary", lambda: store.seed_summary(next(seeds))),
+        ("best high score", store.best_score),
+    ]
+    for name, query in queries:
+        repeats = 3 if "from episodes" in name else 20
+        print("%-32s %10.3f ms" % (name, timed_query(query, repeats)), flush=True)
+    start = time.perf_counter()
+    export_path = path + ".csv"
+    exported = store.export(export_path)
+    print("exported %d rows to CSV at %.0f rows/sec" % (exported, exported / (time.perf_counter() - start)))
+    os.remove(export_path)
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries, exports and benchmarks the episode results store")
+    parser.add_argument("mode", choices=("top", "summary", "highscores", "export", "bench"))
+    parser.add_argument("out", nargs="?", help="file to export to (.csv or .parquet)")
+    parser.add_argument("--db", default=DEFAULT_PATH)
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--policy")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--rows", type=int, default=1000000, help="rows to insert with bench")
+    parser.add_argument("--writers", type=int, default=4, help="processes inserting at once with bench")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.mode == "bench":
+        # a fresh database next to the one given, so a real results store is never filled with made up rows
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(args.db))) as directory:
+            bench(os.path.join(directory, "bench.sqlite"), args.rows, args.writers, args.batch_size)
+        return
+    store = ResultsStore(args.db)
+    if args.mode == "top":
+        for row in store.top_scores(args.n, args.policy):
+            print("score %d level %d ticks %d seed %d policy %s run %s" % row)
+    elif args.mode == "summary":
+        if args.seed is not None:
+            print("%-24s %10s %10s %8s %8s %10s" % ("policy", "episodes", "avg score", "best", "avg lvl", "avg ticks"))
+            for row in store.seed_summary(args.seed):
+                print("%-24s %10d %10.1f %8d %8.2f %10.1f" % row)
+        else:
+            print("%-24s %10s %10s %8s %8s %10s %8s %8s" % ("policy", "episodes", "avg score", "best", "avg lvl",
+                                                           "avg ticks", "ghosts", "cherries"))
+            for row in store.policy_summary():
+                print("%-24s %10d %10.1f %8d %8.2f %10.1f %8d %8d" % row)
+    elif args.mode == "highscores":
+        for name, score, level, recorded in store.high_scores(args.n):
+            print("%-16s %8d  level %d  %s" % (name, score, level, time.strftime("%Y-%m-%d %H:%M",
+                                                                                 time.localtime(recorded))))
+    else:
+        if not args.out:
+            parser.error("export needs a file to export to")
+        print("exported %d rows to %s" % (store.export(args.out), args.out))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Plays lots of headless games of Pacman across a pool of processes
+# run with: python runner.py --episodes 1000 --workers 8 [--db results.sqlite]   (--db saves every episode, see results.py)
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import random
+import time
+
+import headless  # before Main, so no window or sound card is opened
+from Main import Game, DIRECTIONS
+
+
+def random_turns(game, rng):
+    # picks a new random direction every time pacman is about to move
+    if game.ticks % game.pac.move_rate == 0:
+        return rng.choice(DIRECTIONS)
+    return None
+
+
+def keep_going(game, rng):
+    # never steers, pacman stays where he starts
+    return None
+
+
+def load_policy(name):
+    # policies are given as "module:function" or the name of one of the policies in this file
+    # a policy takes the game and a random generator of its own and returns a direction or None
+    if ":" in name:
+        module_name, function_name = name.split(":")
+        return getattr(importlib.import_module(module_name), function_name)
+    return globals()[name]
+
+
+def play_episode(seed, policy_name="random_turns", max_ticks=100000):
+    # plays one game to the end, the game and the policy are both seeded from the episode's seed
+    # so an episode always plays out the same no matter which process runs it
+    policy = load_policy(policy_name)
+    random.seed(seed)  # used by the cherry and the scared ghosts
+    rng = random.Random(seed)
+    game = Game(headless=True)
+    start_lives = game.pac.lives
+    # the game only knows whether this level's cherry was caught, so the total is added up from how that changes
+    cherries = 0
+    caught = False
+    while not game.done and game.ticks < max_ticks:
+        game.step(policy(game, rng))
+        if game.caught_cherry != caught:
+            cherries += game.caught_cherry
+            caught = game.caught_cherry
+    return {"seed": seed, "score": game.score, "level": game.level, "ticks": game.ticks,
+            "lives_lost": start_lives - game.pac.lives, "ghosts_eaten": game.pac.total_ghosts_eaten, "cherries": cherries}
+
+
+def run_episodes(seeds, workers=None, policy_name="random_turns", max_ticks=100000, queued_per_worker=4):
+    # yields the result of each episode as soon as it finishes, in whatever order they finish in
+    # only queued_per_worker episodes per process are handed to the pool at a time, more are submitted as
+    # results come back, so a run of millions of episodes doesn't keep millions of futures waiting
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for seed in seeds:
+            pending.add(executor.submit(play_episode, seed, policy_name, max_ticks))
+            if len(pending) >= workers * queued_per_worker:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays headless games of Pacman in parallel")
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first episode, the rest count up from it")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per core)")
+    parser.add_argument("--policy", default="random_turns", help="random_turns, keep_going or module:function")
+    parser.add_argument("--max-ticks", type=int, default=100000)
+    parser.add_argument("--db", help="SQLite results store to save every episode to (see results.py)")
+    parser.add_argument("--run", default="", help="name the episodes are saved under in the results store")
+    args = parser.parse_args()
+
+    store = None
+    if args.db:
+        from results import ResultsStore
+        store = ResultsStore(args.db)
+    start = time.perf_counter()
+    total_score = 0
+    seeds = range(args.seed, args.seed + args.episodes)
+    for result in run_episodes(seeds, args.workers, args.policy, args.max_ticks):
+        print(json.dumps(result), flush=True)
+        total_score += result["score"]
+        if store is not None:
+            store.add(result, args.run, args.policy)
+    if store is not None:
+        store.close()
+    elapsed = time.perf_counter() - start
+    print("%d episodes in %.2fs, %.1f episodes/sec, average score %.1f"
+          % (args.episodes, elapsed, args.episodes / elapsed, total_score / max(args.episodes, 1)))
+
+
+if __name__ == "__main__":
+    main()
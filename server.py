@@ -0,0 +1,532 @@
+# Streams a live game of Pacman to any number of viewers over TCP, and lets one remote player steer pacman
+# run with: python server.py serve [--port 8765] [--policy random_turns]   (runs the game and serves it)
+#           python server.py watch [--port 8765]                         (a viewer that prints what it sees)
+#           python server.py drive [--port 8765]                         (a remote player that turns at random)
+#           python server.py loadtest --clients 100 500 1000             (how many viewers one core can keep up with)
+# every message is a 4 byte length then the message, a viewer is sent a keyframe with the whole state when it
+# joins and every keyframe_interval ticks after that, and in between only what changed each tick (a delta)
+# a viewer that can't keep up stops being sent deltas until it catches up, then it's sent a keyframe,
+# and if it doesn't catch up within drop_after ticks it's disconnected, so no viewer can hold the game up
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import struct
+import time
+
+import headless  # before Main, so no window or sound card is opened
+from Main import Game, TICK_RATE, UP, DOWN, LEFT, RIGHT, STOP
+from runner import load_policy
+
+DEFAULT_PORT = 8765
+# the first byte a client sends says what it is, after that a player sends a direction code whenever its input
+# changes, the same codes replay.py uses (0 is no input)
+SPECTATOR = 0
+PLAYER = 1
+DIRECTION_CODES = {STOP: 0, UP: 1, DOWN: 2, LEFT: 3, RIGHT: 4}
+CODE_DIRECTIONS = {0: None, 1: UP, 2: DOWN, 3: LEFT, 4: RIGHT}
+
+KEYFRAME = 1
+DELTA = 2
+# length of the rest of the message, kind, tick, the length takes 4 bytes since a big maze's keyframe
+# (one bit per tile) doesn't fit in 65535
+FRAME = struct.Struct("<IBI")
+LENGTH = struct.Struct("<I")
+# keyframe: width, height, score, lives, level, done, cherry visible, cherry tile,
+# then the characters and then one bit per tile with an edible on it
+# tiles are numbered y * width + x and take 4 bytes, big mazes have more than 65535 of them
+KEYFRAME_HEADER = struct.Struct("<HHIBHBBI")
+COUNT = struct.Struct("<H")
+CHARACTER = struct.Struct("<HIB")  # number in charList, tile, direction code << 2 | state
+# a delta starts with a byte of these flags, then the parts that are flagged in this order
+SCORE = 1  # score gained (or lost when a new game starts), signed 4 bytes
+LIVES = 2  # lives left, 1 byte
+LEVEL = 4  # the level, 2 bytes
+PELLETS = 8  # the tiles whose edible was eaten or put back, a 4 byte count then 4 bytes each
+PELLET_BITS = 128  # instead of PELLETS when a list would be bigger, one bit per tile with an edible like a keyframe
+CHARACTERS = 16  # the characters that moved or changed state or direction, a count then CHARACTER each
+CHERRY = 32  # whether the cherry is showing and its tile, 1 byte then 4 bytes
+DONE = 64  # the game has ended, nothing follows
+PELLET_COUNT = struct.Struct("<I")
+CHERRY_PART = struct.Struct("<BI")
+
+
+def character_values(game):
+    # (tile, direction code << 2 | state) for every character in charList order
+    width = game.maze.width
+    return [(c.y * width + c.x, DIRECTION_CODES[c.direction] << 2 | c.state) for c in game.charList]
+
+
+def frame(kind, tick, body):
+    return FRAME.pack(len(body) + FRAME.size - LENGTH.size, kind, tick) + body
+
+
+class StateEncoder:
+    # turns the game into keyframes and deltas, it remembers what the last delta described so the next one
+    # only has what changed since then
+    def __init__(self, game):
+        self.game = game
+        self.score = game.score
+        self.lives = game.pac.lives
+        self.level = game.level
+        self.pellets = game.maze.pellets
+        self.characters = character_values(game)
+        self.cherry = self.cherry_part()
+
+    def cherry_part(self):
+        cherry = self.game.cherry
+        return (self.game.cherry_visible(), cherry.y * self.game.maze.width + cherry.x)
+
+    def keyframe(self):
+        game = self.game
+        maze = game.maze
+        parts = [KEYFRAME_HEADER.pack(maze.width, maze.height, game.score, game.pac.lives, game.level, game.done,
+                                      *self.cherry_part()), COUNT.pack(len(game.charList))]
+        parts += [CHARACTER.pack(number, *values) for number, values in enumerate(character_values(game))]
+        parts.append(self.pellet_bits())
+        return frame(KEYFRAME, game.ticks, b"".join(parts))
+
+    def pellet_bits(self):
+        maze = self.game.maze
+        return maze.pellets.to_bytes((maze.width * maze.height + 7) // 8, "little")
+
+    def delta(self):
+        # what changed since the last delta, None if nothing did
+        game = self.game
+        flags = 0
+        parts = []
+        if game.score != self.score:
+            flags |= SCORE
+            parts.append(struct.pack("<i", game.score - self.score))
+            self.score = game.score
+        if game.pac.lives != self.lives:
+            flags |= LIVES
+            parts.append(struct.pack("<B", game.pac.lives))
+            self.lives = game.pac.lives
+        if game.level != self.level:
+            flags |= LEVEL
+            parts.append(struct.pack("<H", game.level))
+            self.level = game.level
+        changed = self.pellets ^ game.maze.pellets
+        if changed:
+            # a new level or game puts every edible back, that's sent as the bits since a list would be far bigger
+            size = (game.maze.width * game.maze.height + 7) // 8
+            tiles = []
+            while changed and 4 * len(tiles) < size:
+                bit = changed & -changed
+                tiles.append(bit.bit_length() - 1)
+                changed ^= bit
+            if changed:
+                flags |= PELLET_BITS
+                parts.append(self.pellet_bits())
+            else:
+                flags |= PELLETS
+                parts.append(struct.pack("<I%dI" % len(tiles), len(tiles), *tiles))
+            self.pellets = game.maze.pellets
+        characters = character_values(game)
+        if characters != self.characters:
+            flags |= CHARACTERS
+            moved = [CHARACTER.pack(number, *values) for number, (values, old) in
+                     enumerate(zip(characters, self.characters)) if values != old]
+            parts.append(COUNT.pack(len(moved)) + b"".join(moved))
+            self.characters = characters
+        cherry = self.cherry_part()
+        if cherry != self.cherry:
+            flags |= CHERRY
+            parts.append(CHERRY_PART.pack(*cherry))
+            self.cherry = cherry
+        if game.done:
+            flags |= DONE
+        if not flags:
+            return None
+        return frame(DELTA, game.ticks, bytes((flags,)) + b"".join(parts))
+
+
+class Mirror:
+    # a viewer's copy of the game's state, built up from the messages the server sends
+    def __init__(self):
+        self.synced = False  # nothing can be applied until the first keyframe
+        self.tick = 0
+        self.keyframes = 0
+        self.deltas = 0
+
+    def apply(self, message):
+        # message is everything after the 4 length bytes
+        kind, self.tick = struct.unpack_from("<BI", message)
+        offset = FRAME.size - LENGTH.size
+        if kind == KEYFRAME:
+            (self.width, self.height, self.score, self.lives, self.level, done, cherry_visible,
+             cherry_tile) = KEYFRAME_HEADER.unpack_from(message, offset)
+            self.done = bool(done)
+            self.cherry = (bool(cherry_visible), cherry_tile)
+            offset += KEYFRAME_HEADER.size
+            count, = COUNT.unpack_from(message, offset)
+            offset += COUNT.size
+            self.characters = {}
+            for i in range(count):
+                number, tile, code = CHARACTER.unpack_from(message, offset)
+                self.characters[number] = (tile, code)
+                offset += CHARACTER.size
+            self.pellets = int.from_bytes(message[offset:], "little")
+            self.synced = True
+            self.keyframes += 1
+            return
+        if not self.synced:
+            return
+        flags = message[offset]
+        offset += 1
+        if flags & SCORE:
+            self.score += struct.unpack_from("<i", message, offset)[0]
+            offset += 4
+        if flags & LIVES:
+            self.lives = message[offset]
+            offset += 1
+        if flags & LEVEL:
+            self.level, = struct.unpack_from("<H", message, offset)
+            offset += 2
+        if flags & PELLETS:
+            count, = PELLET_COUNT.unpack_from(message, offset)
+            for tile in struct.unpack_from("<%dI" % count, message, offset + PELLET_COUNT.size):
+                self.pellets ^= 1 << tile
+            offset += PELLET_COUNT.size + 4 * count
+        if flags & PELLET_BITS:
+            size = (self.width * self.height + 7) // 8
+            self.pellets = int.from_bytes(message[offset:offset + size], "little")
+            offset += size
+        if flags & CHARACTERS:
+            count, = COUNT.unpack_from(message, offset)
+            offset += COUNT.size
+            for i in range(count):
+                number, tile, code = CHARACTER.unpack_from(message, offset)
+                self.characters[number] = (tile, code)
+                offset += CHARACTER.size
+        if flags & CHERRY:
+            visible, tile = CHERRY_PART.unpack_from(message, offset)
+            self.cherry = (bool(visible), tile)
+        self.done = bool(flags & DONE)
+        self.deltas += 1
+
+    def matches(self, game):
+        # whether this is the same state as the game's, used to check the encoding
+        return (self.synced and self.tick == game.ticks and self.score == game.score and self.lives == game.pac.lives
+                and self.level == game.level and self.pellets == game.maze.pellets
+                and [self.characters[n] for n in range(len(game.charList))] == character_values(game))
+
+
+async def read_message(reader):
+    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(length)
+
+
+class Client:
+    def __init__(self, writer, role):
+        self.writer = writer
+        self.role = role
+        self.needs_keyframe = True  # sent the next tick, the client has nothing to apply deltas to until then
+        self.behind_since = None  # the server tick (GameServer.ticks_run) it fell behind on, None while it keeps up
+
+
+class GameServer:
+    # runs one game at TICK_RATE and sends it to every client connected, when the game ends a new one starts
+    # pacman is steered by the first player that connects, or by the policy (see runner.py) when there isn't one
+    # a client is behind when more than high_water bytes sent to it are still waiting to go out
+    def __init__(self, policy_name="random_turns", keyframe_interval=2 * TICK_RATE, high_water=64 * 1024,
+                 drop_after=3 * TICK_RATE, **game_options):
+        self.policy = load_policy(policy_name)
+        self.rng = random.Random()
+        self.keyframe_interval = keyframe_interval
+        self.high_water = high_water
+        self.drop_after = drop_after
+        self.game_options = game_options
+        self.clients = []
+        self.handlers = set()  # the tasks reading from each connection
+        self.player = None
+        self.player_direction = None
+        self.game = None
+        self.encoder = None
+        self.new_game()
+        # the game's ticks stop during the pause after a death and start again from 0 with each new game,
+        # so keyframes and how long a client has been behind go by the ticks the server has run instead
+        self.ticks_run = 0
+        self.last_keyframe = 0
+        # counters for the load test
+        self.late_ticks = 0  # ticks that started after the time they were due
+        self.busy_time = 0  # time spent running ticks and sending them out
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.skipped = 0  # messages not sent to a client because it was behind
+        self.dropped = 0
+
+    def new_game(self):
+        # the encoder carries on from the last game, so the first delta of the new one has everything that's
+        # different about it and viewers don't have to be sent a keyframe
+        self.game = Game(headless=True, death_pause_ticks=2 * TICK_RATE, **self.game_options)
+        if self.encoder is None:
+            self.encoder = StateEncoder(self.game)
+        else:
+            self.encoder.game = self.game
+
+    async def handle_client(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        try:
+            role = (await reader.readexactly(1))[0]
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            self.handlers.discard(asyncio.current_task())
+            return
+        client = Client(writer, role)
+        self.clients.append(client)
+        if role == PLAYER and self.player is None:
+            self.player = client
+        try:
+            while True:
+                # spectators send nothing, this waits for them to disconnect
+                code = (await reader.readexactly(1))[0]
+                if client is self.player:
+                    self.player_direction = CODE_DIRECTIONS.get(code)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        self.disconnect(client)
+        self.handlers.discard(asyncio.current_task())
+
+    async def close(self):
+        # disconnects everyone and waits for the connections' tasks to see it
+        for client in list(self.clients):
+            self.disconnect(client)
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+
+    def disconnect(self, client):
+        # aborted rather than closed, closing would wait for a client that's stopped reading to take what's left
+        if client in self.clients:
+            self.clients.remove(client)
+            client.writer.transport.abort()
+        if client is self.player:
+            self.player = None
+            self.player_direction = None
+
+    def tick(self):
+        game = self.game
+        if self.player is not None:
+            direction = self.player_direction
+        else:
+            direction = self.policy(game, self.rng)
+        game.step(direction)
+        self.broadcast()
+        if game.done:
+            self.new_game()
+
+    def broadcast(self):
+        # the delta is always worked out so the encoder keeps up with the game, even if nobody is sent it
+        delta = self.encoder.delta()
+        keyframe = None
+        tick = self.ticks_run
+        periodic = tick - self.last_keyframe >= self.keyframe_interval
+        if periodic:
+            self.last_keyframe = tick
+        for client in list(self.clients):
+            transport = client.writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.high_water:
+                # behind: skip it until it catches up, then give it a keyframe since it missed deltas
+                if client.behind_since is None:
+                    client.behind_since = tick
+                elif tick - client.behind_since > self.drop_after:
+                    self.dropped += 1
+                    self.disconnect(client)
+                    continue
+                client.needs_keyframe = True
+                self.skipped += 1
+                continue
+            client.behind_since = None
+            if client.needs_keyframe or periodic:
+                if keyframe is None:
+                    keyframe = self.encoder.keyframe()
+                message = keyframe
+                client.needs_keyframe = False
+            elif delta is not None:
+                message = delta
+            else:
+                continue
+            transport.write(message)
+            self.bytes_sent += len(message)
+            self.messages_sent += 1
+
+    async def run(self, max_ticks=None):
+        # the game loop, ticks that fall behind are run straight away without catching up on the ones missed
+        loop = asyncio.get_running_loop()
+        tick_time = 1 / TICK_RATE
+        next_tick = loop.time()
+        while max_ticks is None or self.ticks_run < max_ticks:
+            start = time.perf_counter()
+            self.tick()
+            self.busy_time += time.perf_counter() - start
+            self.ticks_run += 1
+            next_tick += tick_time
+            delay = next_tick - loop.time()
+            if delay < 0:
+                self.late_ticks += 1
+                next_tick = loop.time()
+            await asyncio.sleep(max(delay, 0))
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, max_ticks=None):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await self.run(max_ticks)
+            await self.close()
+
+
+async def connect(host, port, role):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(bytes((role,)))
+    return reader, writer
+
+
+async def watch(host, port):
+    # prints what the viewer's copy of the game looks like once a second
+    reader, writer = await connect(host, port, SPECTATOR)
+    mirror = Mirror()
+    received = 0
+    last_print = time.perf_counter()
+    while True:
+        message = await read_message(reader)
+        received += len(message) + LENGTH.size
+        mirror.apply(message)
+        now = time.perf_counter()
+        if now - last_print >= 1 and mirror.synced:
+            print("tick %d score %d lives %d level %d  %d pellets left  %.0f bytes/sec"
+                  % (mirror.tick, mirror.score, mirror.lives, mirror.level, bin(mirror.pellets).count("1"),
+                     received / (now - last_print)), flush=True)
+            received = 0
+            last_print = now
+
+
+async def drive(host, port):
+    # a remote player that picks a new direction at random a few times a second
+    reader, writer = await connect(host, port, PLAYER)
+    mirror = Mirror()
+    code = 0
+    while True:
+        mirror.apply(await read_message(reader))
+        if mirror.synced and mirror.tick % 16 == 0:
+            new_code = random.randint(1, 4)
+            if new_code != code:
+                code = new_code
+                writer.write(bytes((code,)))
+
+
+async def spectate_many(host, port, count, ready, results, seconds):
+    # count viewers in one process, only the first one decodes what it's sent, the rest just read it
+    # which is all a viewer has to do to keep the server from seeing it as behind
+    connections = [await connect(host, port, SPECTATOR) for i in range(count)]
+    ready.set()
+    mirror = Mirror()
+    received = [0]
+
+    async def read_all(reader, decode):
+        try:
+            while True:
+                message = await read_message(reader)
+                received[0] += len(message) + LENGTH.size
+                if decode:
+                    mirror.apply(message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+    tasks = [asyncio.create_task(read_all(reader, i == 0)) for i, (reader, writer) in enumerate(connections)]
+    await asyncio.sleep(seconds)
+    for task in tasks:
+        task.cancel()
+    results.put((received[0], mirror.keyframes, mirror.deltas))
+
+
+def run_spectators(port, count, ready, results, seconds):
+    asyncio.run(spectate_many("127.0.0.1", port, count, ready, results, seconds))
+
+
+async def load_test_round(clients, seconds, processes, policy_name):
+    # serves one game to clients viewers spread over some processes and measures the server while they watch
+    server = GameServer(policy_name)
+    listener = await asyncio.start_server(server.handle_client, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = []
+    for i in range(processes):
+        count = clients * (i + 1) // processes - clients * i // processes
+        ready = context.Event()
+        process = context.Process(target=run_spectators, args=(port, count, ready, results, seconds + 10),
+                                  daemon=True)
+        process.start()
+        workers.append((process, ready))
+    # the game runs while the viewers connect, the measurement starts once they all have
+    game_loop = asyncio.create_task(server.run())
+    while len(server.clients) < clients:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(1)
+    start_ticks, start_late, start_busy = server.ticks_run, server.late_ticks, server.busy_time
+    start_bytes, start_dropped, start_skipped = server.bytes_sent, server.dropped, server.skipped
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    await asyncio.sleep(seconds)
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    result = {"clients": clients, "ticks_per_sec": (server.ticks_run - start_ticks) / wall,
+              "late_ticks": server.late_ticks - start_late, "server_cpu": cpu / wall,
+              "tick_busy": (server.busy_time - start_busy) / wall, "mb_per_sec": (server.bytes_sent - start_bytes) / wall / 1e6,
+              "skipped": server.skipped - start_skipped, "dropped": server.dropped - start_dropped}
+    game_loop.cancel()
+    await server.close()
+    listener.close()
+    for process, ready in workers:
+        process.terminate()
+        process.join()
+    return result
+
+
+def load_test(counts, seconds, processes, policy_name):
+    # server_cpu is the share of a core the server process used while serving, the viewers run in
+    # other processes so it's only the server's work
+    print("%8s %10s %6s %11s %10s %8s %8s %8s" % ("clients", "ticks/sec", "late", "server_cpu", "tick_busy", "MB/sec",
+                                                   "skipped", "dropped"))
+    for clients in counts:
+        result = asyncio.run(load_test_round(clients, seconds, processes, policy_name))
+        print("%8d %10.1f %6d %10.0f%% %9.0f%% %8.2f %8d %8d"
+              % (clients, result["ticks_per_sec"], result["late_ticks"], result["server_cpu"] * 100,
+                 result["tick_busy"] * 100, result["mb_per_sec"], result["skipped"], result["dropped"]), flush=True)
+        yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a live game of Pacman to viewers and a remote player")
+    parser.add_argument("mode", choices=("serve", "watch", "drive", "loadtest"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--policy", default="random_turns", help="steers pacman while no player is connected")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 500, 1000],
+                        help="numbers of viewers to load test with")
+    parser.add_argument("--seconds", type=float, default=5, help="how long each load test round measures for")
+    parser.add_argument("--processes", type=int, default=None, help="processes the load test's viewers run in")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        print("serving on %s:%d" % (args.host, args.port))
+        asyncio.run(GameServer(args.policy).serve(args.host, args.port))
+    elif args.mode == "watch":
+        asyncio.run(watch(args.host, args.port))
+    elif args.mode == "drive":
+        asyncio.run(drive(args.host, args.port))
+    else:
+        processes = args.processes or max(1, (os.cpu_count() or 2) - 1)
+        results = list(load_test(args.clients, args.seconds, processes, args.policy))
+        # how many viewers would use up a whole core, from how the server's share of it grows between the
+        # smallest and the biggest round
+        low = min(results, key=lambda r: r["clients"])
+        high = max(results, key=lambda r: r["clients"])
+        if high["clients"] > low["clients"] and high["server_cpu"] > low["server_cpu"]:
+            per_client = (high["server_cpu"] - low["server_cpu"]) / (high["clients"] - low["clients"])
+            base = low["server_cpu"] - per_client * low["clients"]
+            print("about %d viewers per core at %d ticks/sec" % ((1 - base) / per_client, TICK_RATE))
+
+
+if __name__ == "__main__":
+    main()
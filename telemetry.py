@@ -0,0 +1,130 @@
+# Logs the state of every tick of a game to columnar files that can be read back as numpy arrays
+# a log is a directory with one file per column plus schema.json, every column file is a flat array
+# of fixed width values that grows by one row per tick
+import json
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+SCHEMA_FILE = "schema.json"
+
+
+def row_layout(num_characters):
+    # one row per tick, the struct and the numpy dtype describe the same packed layout,
+    # x, y and state have a value for every character in Game.charList order (the ghosts then pacman),
+    # lives are 2 bytes since simulations give pacman hundreds of them, more than 65535 are logged as 65535
+    row = struct.Struct("<IIiBHH%dH%dH%dB" % (num_characters, num_characters, num_characters))
+    row_dtype = np.dtype([("episode", "<u4"), ("tick", "<u4"), ("score_delta", "<i4"), ("pellets_eaten", "u1"),
+                          ("lives", "<u2"), ("level", "<u2"), ("x", "<u2", num_characters),
+                          ("y", "<u2", num_characters), ("state", "u1", num_characters)])
+    return row, row_dtype
+
+
+class Telemetry:
+    # rows are packed into a buffer of chunk_rows ticks, full buffers are written out by a background thread
+    # at most max_pending full buffers wait to be written before record has to wait for the writer
+    # the columns are laid out for the number of characters in the first game attached, every game logged
+    # after it has to have the same number
+    def __init__(self, path, chunk_rows=65536, max_pending=4):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.num_characters = None
+        self.row = None
+        self.row_dtype = None
+        self.files = {}
+
+        self.chunk_rows = chunk_rows
+        self.buffer = None
+        self.rows = 0
+        self.pending = queue.Queue(max_pending)
+        self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+
+        self.episode = 0
+        self.last_score = 0
+        self.last_num_edibles = 0
+        self.last_level = 1
+
+    def attach(self, game, episode=0):
+        # logs every tick the game runs from now on under the given episode number
+        if self.num_characters is None:
+            self.create_columns(len(game.charList))
+        elif len(game.charList) != self.num_characters:
+            raise ValueError("the log has %d characters a tick, the game has %d"
+                             % (self.num_characters, len(game.charList)))
+        game.telemetry = self
+        self.episode = episode
+        self.last_score = game.score
+        self.last_num_edibles = game.maze.num_edibles
+        self.last_level = game.level
+
+    def create_columns(self, num_characters):
+        self.num_characters = num_characters
+        self.row, self.row_dtype = row_layout(num_characters)
+        with open(os.path.join(self.path, SCHEMA_FILE), "w") as f:
+            json.dump({name: [self.row_dtype[name].base.str, list(self.row_dtype[name].shape)]
+                       for name in self.row_dtype.names}, f)
+        self.files = {name: open(os.path.join(self.path, name + ".bin"), "ab") for name in self.row_dtype.names}
+        self.buffer = bytearray(self.chunk_rows * self.row.size)
+
+    def record(self, game):
+        # called by Game.advance after each tick has run
+        num_edibles = game.maze.num_edibles
+        if game.level != self.last_level:
+            pellets_eaten = self.last_num_edibles  # the last dots were eaten and the maze was refilled
+        else:
+            pellets_eaten = self.last_num_edibles - num_edibles
+        characters = game.charList
+        self.row.pack_into(self.buffer, self.rows * self.row.size, self.episode, game.ticks,
+                           game.score - self.last_score, pellets_eaten, min(game.pac.lives, 65535), game.level,
+                           *[c.x for c in characters], *[c.y for c in characters], *[c.state for c in characters])
+        self.last_score = game.score
+        self.last_num_edibles = num_edibles
+        self.last_level = game.level
+        self.rows += 1
+        if self.rows == self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        # hands the rows packed so far to the writer and starts a new buffer
+        if self.rows:
+            self.pending.put((self.buffer, self.rows))
+            self.buffer = bytearray(self.chunk_rows * self.row.size)
+            self.rows = 0
+
+    def write_chunks(self):
+        while True:
+            chunk = self.pending.get()
+            if chunk is None:
+                return
+            buffer, rows = chunk
+            table = np.frombuffer(buffer, self.row_dtype, count=rows)
+            for name, f in self.files.items():
+                f.write(np.ascontiguousarray(table[name]).tobytes())
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+        for f in self.files.values():
+            f.close()
+
+
+def read_telemetry(path):
+    # returns a read only memory mapped numpy array for every column, nothing is copied into memory
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    columns = {}
+    for name, (dtype, shape) in schema.items():
+        dtype = np.dtype(dtype)
+        file_name = os.path.join(path, name + ".bin")
+        row_size = dtype.itemsize * int(np.prod(shape))
+        rows = os.path.getsize(file_name) // row_size
+        if rows == 0:
+            columns[name] = np.zeros((0,) + tuple(shape), dtype)
+        else:
+            columns[name] = np.memmap(file_name, dtype, mode="r", shape=(rows,) + tuple(shape))
+    return columns